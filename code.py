@@ -1,17 +1,9 @@
-from pimoronikeypad import PimoroniKeypad
+from pimoronikeypad import PimoroniKeypad, KeypadSerial, KeypadScheduler
 
 keypad = PimoroniKeypad()
+serial = KeypadSerial(keypad)
 
-while True:
-        
-    for key in keypad.load_pressed_keys():
-        if key.is_pressed and not key.still_pressed:
-            
-            if keypad.is_toggled_on and not key.is_toggled_on:
-                keypad.run_command(key)
-            
-            elif key.is_toggled_on:
-                keypad.reset()
-                
-            elif key.is_programmed:
-                keypad.toggle_on(key, brightness=1.0)
\ No newline at end of file
+# Runs the tasks of the main loop: scanning the keys, sending commands, effects and housekeeping.
+# While profiling, prints how often each task went over its budget every minute
+scheduler = KeypadScheduler.for_keypad(keypad, serial, report_interval=60 if keypad.profiler is not None else None)
+scheduler.run()
@@ -0,0 +1,253 @@
+import math
+
+from .KeypadTicks import ticks_diff
+
+
+"""
+KeypadEffects
+================================================================================
+Provides animated effects for the whole keypad. Each effect computes an entire
+frame at a time, the red, green and blue values of the 16 keys in a flat
+buffer, using integer maths and lookup tables computed once when the first
+effect is created. Effects are given the time in milliseconds from ticks_ms(),
+a small integer, so rendering a frame allocates no memory
+"""
+
+class KeypadEffect():
+    """ The base of an effect, rendering a frame of the whole keypad per tick """
+
+    sine = None
+    """ A table of 256 sine values over a full wave, scaled to between 0 and 255 """
+
+    hue = None
+    """ A table of red, green and blue values for 256 hues around the colour wheel """
+
+    distance = None
+    """ A table of the distance between each pair of keys, 16 units per key """
+
+    def __init__(self, frame_rate=30):
+        """
+        The base of an effect, rendering a frame of the whole keypad per tick. Initialization sets the following property:
+        - frame_rate
+        """
+        self.frame_rate = frame_rate
+        if KeypadEffect.sine is None:
+            KeypadEffect._load_tables()
+
+    @property
+    def frame_rate(self):
+        """ The number of frames rendered each second """
+        return self._frame_rate
+
+    @frame_rate.setter
+    def frame_rate(self, value):
+        if isinstance(value, (int, float)):
+            if value > 0:
+                self._frame_rate = value
+                self.interval = max(1, int(1000 / value))
+            else:
+                raise ValueError('frame_rate must be greater than 0')
+        else:
+            raise TypeError('frame_rate must be a number')
+
+    @frame_rate.deleter
+    def frame_rate(self):
+        raise AttributeError('Do not delete frame_rate')
+
+    def render(self, frame, now):
+        """ Fills the frame with the red, green, and blue values of each key at the given time in milliseconds from ticks_ms() """
+        raise NotImplementedError('render must be implemented by the effect')
+
+    def press(self, index, now):
+        """ Called when the key with the given index is pressed, at the given time in milliseconds from ticks_ms() """
+        pass
+
+    @staticmethod
+    def _load_tables():
+        """ Computes the lookup tables shared by every effect """
+        sine = bytearray(256)
+        for step in range(256):
+            sine[step] = int((math.sin(step * 2 * math.pi / 256) + 1) * 127.5)
+
+        hue = bytearray(768)
+        for step in range(256):
+            sector = step // 43
+            rising = (step - sector * 43) * 6
+            falling = 255 - rising
+            if sector == 0:
+                colour = (255, rising, 0)
+            elif sector == 1:
+                colour = (falling, 255, 0)
+            elif sector == 2:
+                colour = (0, 255, rising)
+            elif sector == 3:
+                colour = (0, falling, 255)
+            elif sector == 4:
+                colour = (rising, 0, 255)
+            else:
+                colour = (255, 0, falling)
+            hue[step * 3] = max(0, min(255, colour[0]))
+            hue[step * 3 + 1] = max(0, min(255, colour[1]))
+            hue[step * 3 + 2] = max(0, min(255, colour[2]))
+
+        distance = bytearray(256)
+        for start in range(16):
+            for end in range(16):
+                rows = start // 4 - end // 4
+                columns = start % 4 - end % 4
+                distance[start * 16 + end] = int(math.sqrt(rows * rows + columns * columns) * 16)
+
+        KeypadEffect.sine = sine
+        KeypadEffect.hue = hue
+        KeypadEffect.distance = distance
+
+
+class RainbowCycle(KeypadEffect):
+    """ Cycles the colours of the rainbow across the keypad """
+
+    def __init__(self, speed=64, spread=16, frame_rate=30):
+        """
+        Cycles the colours of the rainbow across the keypad. Initialization sets the following properties:
+        - speed, the number of steps around the colour wheel (of 256) moved each second
+        - spread, the number of steps around the colour wheel between neighbouring keys
+        """
+        super().__init__(frame_rate)
+        self.speed = speed
+        self.spread = spread
+
+    def render(self, frame, now):
+        """ Fills the frame with the rainbow at the given time """
+        hue = self.hue
+        # Taking the time within a turn of the colour wheel first keeps the values small integers
+        cycle = int(256000 / self.speed) if self.speed else 0
+        offset = (now % cycle) * 256 // cycle if cycle else 0
+        spread = self.spread
+        for index in range(16):
+            step = ((offset + index * spread) & 0xFF) * 3
+            frame[index * 3] = hue[step]
+            frame[index * 3 + 1] = hue[step + 1]
+            frame[index * 3 + 2] = hue[step + 2]
+
+
+class Breathing(KeypadEffect):
+    """ Slowly fades the whole keypad in and out in a single colour """
+
+    def __init__(self, colour, period=4.0, frame_rate=30):
+        """
+        Slowly fades the whole keypad in and out in a single colour. Initialization sets the following properties:
+        - colour, an RGB object
+        - period, the number of seconds for each breath
+        """
+        super().__init__(frame_rate)
+        self.colour = colour
+        self.period = period
+
+    def render(self, frame, now):
+        """ Fills the frame with the colour at the level of the breath at the given time """
+        period = int(self.period * 1000) or 1
+        level = self.sine[(now % period) * 256 // period]
+        red = self.colour.red * level >> 8
+        green = self.colour.green * level >> 8
+        blue = self.colour.blue * level >> 8
+        for index in range(0, 48, 3):
+            frame[index] = red
+            frame[index + 1] = green
+            frame[index + 2] = blue
+
+
+class Ripple(KeypadEffect):
+    """ Sends a ring of colour outwards from each key as it is pressed """
+
+    ripples = 4
+    """ The number of ripples that can be on the keypad at once """
+
+    def __init__(self, colour, speed=6.0, width=1.0, frame_rate=30):
+        """
+        Sends a ring of colour outwards from each key as it is pressed. Initialization sets the following properties:
+        - colour, an RGB object
+        - speed, the number of keys the ring travels each second
+        - width, the width of the ring in keys
+        """
+        super().__init__(frame_rate)
+        self.colour = colour
+        self.speed = speed
+        self.width = width
+        self._origins = bytearray(self.ripples)
+        self._starts = [-1] * self.ripples
+        self._levels = bytearray(16)
+        self._next = 0
+
+    def press(self, index, now):
+        """ Starts a ripple from the pressed key, replacing the oldest ripple """
+        self._origins[self._next] = index
+        self._starts[self._next] = now
+        self._next = (self._next + 1) % self.ripples
+
+    def render(self, frame, now):
+        """ Fills the frame with the rings at the given time """
+        levels = self._levels
+        distance = self.distance
+        width = int(self.width * 16) or 1
+        speed = int(self.speed * 16)
+        for index in range(16):
+            levels[index] = 0
+
+        for ripple in range(self.ripples):
+            start = self._starts[ripple]
+            if start < 0:
+                continue
+            radius = ticks_diff(now, start) * speed // 1000
+            if radius > 68 + width or radius < 0:
+                # The ring has left the keypad
+                self._starts[ripple] = -1
+                continue
+            origin = self._origins[ripple] * 16
+            for index in range(16):
+                difference = distance[origin + index] - radius
+                if difference < 0:
+                    difference = -difference
+                if difference < width:
+                    level = 255 - difference * 255 // width
+                    if level > levels[index]:
+                        levels[index] = level
+
+        red = self.colour.red
+        green = self.colour.green
+        blue = self.colour.blue
+        for index in range(16):
+            level = levels[index]
+            frame[index * 3] = red * level >> 8
+            frame[index * 3 + 1] = green * level >> 8
+            frame[index * 3 + 2] = blue * level >> 8
+
+
+class Heatmap(KeypadEffect):
+    """ Colours each key from blue to red by how often it is pressed """
+
+    def __init__(self, counts=None, frame_rate=5):
+        """
+        Colours each key from blue to red by how often it is pressed. Initialization sets the following property:
+        - counts, a list of the number of presses of each key, counted from when the effect starts if not given
+        """
+        super().__init__(frame_rate)
+        if counts is None:
+            counts = [0] * 16
+        if len(counts) != 16:
+            raise ValueError('counts must have a value for each of the 16 keys')
+        self.counts = counts
+
+    def press(self, index, now):
+        """ Counts the press of the key """
+        self.counts[index] += 1
+
+    def render(self, frame, now):
+        """ Fills the frame with the colour of each key's count """
+        hue = self.hue
+        counts = self.counts
+        top = max(counts) or 1
+        for index in range(16):
+            # Blue (170) for the least pressed keys through to red (0) for the most
+            step = (170 * (top - counts[index]) // top) * 3
+            frame[index * 3] = hue[step]
+            frame[index * 3 + 1] = hue[step + 1]
+            frame[index * 3 + 2] = hue[step + 2]
@@ -0,0 +1,101 @@
+"""
+KeypadLayout
+================================================================================
+Provides functionality to type text using a keyboard layout selected from the
+configuration, backed by the precomputed tables found in the layouts folder
+"""
+
+class KeypadLayout():
+    """ A keyboard layout used to turn text into keycodes """
+
+    layouts = ('us', 'uk', 'de')
+    """ The layouts available in the layouts folder, mapped to the value from the configuration """
+
+    def __init__(self, keyboard, name='us'):
+        """
+        A keyboard layout used to turn text into keycodes. Initialization sets the following properties:
+        - keyboard
+        - name
+
+        The layout tables are not loaded until the first character is looked up
+        """
+        self.keyboard = keyboard
+        self.name = name
+        self._ascii = None
+        self._higher = None
+
+    @property
+    def keyboard(self):
+        """ The keyboard used to send the keycodes """
+        return self._keyboard
+
+    @keyboard.setter
+    def keyboard(self, value):
+        if value is not None:
+            self._keyboard = value
+        else:
+            raise TypeError('keyboard must be a Keyboard object')
+
+    @keyboard.deleter
+    def keyboard(self):
+        raise AttributeError('Do not delete keyboard')
+
+    @property
+    def name(self):
+        """ The name of the layout, as set in the configuration """
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        if isinstance(value, str):
+            if value in self.layouts:
+                self._name = value
+                self._ascii = None
+                self._higher = None
+            else:
+                raise ValueError('name must be one of: ' + ', '.join(self.layouts))
+        else:
+            raise TypeError('name must be a string')
+
+    @name.deleter
+    def name(self):
+        raise AttributeError('Do not delete name')
+
+    def load(self):
+        """ Imports the tables of the layout, if they have not already been loaded """
+        if self._ascii is None:
+            module = __import__('pimoronikeypad.layouts.' + self.name, None, None, ('ASCII', 'HIGHER'))
+            self._ascii = module.ASCII
+            self._higher = module.HIGHER
+
+    def keycodes(self, character):
+        """ Returns the modifier and keycode that type the given character, as a tuple (modifier, keycode) """
+        return self.code_point_keycodes(ord(character))
+
+    def code_point_keycodes(self, code_point):
+        """ Returns the modifier and keycode that type the character with the given code point, as a tuple (modifier, keycode) """
+        self.load()
+        if code_point < 128:
+            modifier = self._ascii[code_point * 2]
+            keycode = self._ascii[code_point * 2 + 1]
+        else:
+            value = self._higher.get(code_point, 0)
+            modifier = value >> 8
+            keycode = value & 0xFF
+        if not keycode:
+            raise ValueError('No keycode available for character ' + repr(chr(code_point)) + ' in the ' + self.name + ' layout')
+        return modifier, keycode
+
+    def write(self, text):
+        """ Takes in text, and types it via the keyboard """
+        for character in text:
+            self.write_code_point(ord(character))
+
+    def write_code_point(self, code_point):
+        """ Types the character with the given code point via the keyboard """
+        modifier, keycode = self.code_point_keycodes(code_point)
+        if modifier:
+            self._keyboard.press(modifier, keycode)
+        else:
+            self._keyboard.press(keycode)
+        self._keyboard.release_all()
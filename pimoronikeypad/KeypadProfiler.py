@@ -0,0 +1,210 @@
+import gc
+import time
+from array import array
+
+try:
+    from supervisor import ticks_ms
+except ImportError:
+    # Not available when simulated on a computer
+    ticks_ms = None
+
+
+"""
+KeypadProfiler
+================================================================================
+Provides a profiling mode, timing the main entry points of the keypad and
+measuring the memory they allocate, to find the calls that trigger garbage
+collection pauses
+"""
+
+class KeypadProfiler():
+    """ Records the time taken and memory allocated by calls to the keypad, grouped by subsystem """
+
+    keypad_subsystems = {
+        'load_pressed_keys': 'scan',
+        'update': 'leds',
+        'show_frame': 'leds',
+        'execute': 'commands',
+        'send_actions': 'hid',
+        'save_state': 'state'
+    }
+    """ A dictionary mapping the keypad methods wrapped by attach() to their subsystem """
+
+    key_subsystems = {
+        'fade_to_colour': 'fade'
+    }
+    """ A dictionary mapping the key methods wrapped by attach() to their subsystem """
+
+    def __init__(self, samples=32):
+        """
+        Records the time taken and memory allocated by calls to the keypad. Initialization sets the following property:
+        - samples, the number of recent calls kept for each subsystem
+        """
+        self.samples = samples
+        self._subsystems = {}
+
+    @property
+    def samples(self):
+        """ The number of recent calls kept for each subsystem """
+        return self._samples
+
+    @samples.setter
+    def samples(self, value):
+        if isinstance(value, int):
+            if value > 0:
+                self._samples = value
+            else:
+                raise ValueError('samples must be greater than 0')
+        else:
+            raise TypeError('samples must be an integer')
+
+    @samples.deleter
+    def samples(self):
+        raise AttributeError('Do not delete samples')
+
+    def attach(self, keypad):
+        """ Wraps the main entry points of the keypad and its keys """
+        for name, subsystem in self.keypad_subsystems.items():
+            self.wrap(keypad, name, subsystem)
+        for key in keypad.keys:
+            for name, subsystem in self.key_subsystems.items():
+                self.wrap(key, name, subsystem)
+
+    def wrap(self, target, name, subsystem):
+        """
+        Replaces the named method of the target with one that records each call under the subsystem. The wrapper
+        takes up to three positional arguments, so calling it doesn't allocate a tuple and dictionary of arguments
+        """
+        if subsystem not in self._subsystems:
+            self._subsystems[subsystem] = _Subsystem(subsystem, self.samples)
+        record = self._subsystems[subsystem].record
+        method = getattr(target, name)
+        mem_free = getattr(gc, 'mem_free', None) or _no_mem_free
+        now = _now
+        elapsed = _elapsed
+
+        def profiled(first=_missing, second=_missing, third=_missing):
+            start = now()
+            free_before = mem_free()
+            if first is _missing:
+                result = method()
+            elif second is _missing:
+                result = method(first)
+            elif third is _missing:
+                result = method(first, second)
+            else:
+                result = method(first, second, third)
+            free_after = mem_free()
+            record(elapsed(start, now()), free_before, free_after)
+            return result
+
+        setattr(target, name, profiled)
+
+    def reset(self):
+        """ Clears everything recorded so far """
+        for subsystem in self._subsystems.values():
+            subsystem.reset()
+
+    def report(self):
+        """ Prints the calls, time, allocations and garbage collection pauses of each subsystem """
+        print('{:<10}{:>8}{:>10}{:>10}{:>11}{:>10}{:>11}'.format('subsystem', 'calls', 'avg us', 'max us', 'max alloc', 'gc calls', 'max gc us'))
+        for subsystem in self._subsystems.values():
+            subsystem.report_line()
+        print('recent calls, as us/bytes allocated, most recent last (* = garbage collected)')
+        for subsystem in self._subsystems.values():
+            subsystem.report_samples()
+
+
+class _Subsystem():
+    """ The calls recorded for a single subsystem """
+
+    def __init__(self, name, samples):
+        """ The calls recorded for a single subsystem """
+        self.name = name
+        self._durations = array('l', [0] * samples)
+        self._allocations = array('l', [0] * samples)
+        self.reset()
+
+    def reset(self):
+        """ Clears everything recorded so far """
+        for index in range(len(self._durations)):
+            self._durations[index] = 0
+            self._allocations[index] = 0
+        self._next = 0
+        self.calls = 0
+        self.total = 0
+        self.longest = 0
+        self.most_allocated = 0
+        self.pauses = 0
+        self.longest_pause = 0
+
+    def record(self, duration, free_before, free_after):
+        """
+        Records a call, a rise in free memory over the call means a garbage collection ran during it. The pause itself
+        can't be measured, so longest_pause is the longest call a collection ran during
+        """
+        collected = free_after > free_before
+        allocated = -1 if collected else free_before - free_after
+        self._durations[self._next] = duration
+        self._allocations[self._next] = allocated
+        self._next = (self._next + 1) % len(self._durations)
+        self.calls += 1
+        self.total += duration
+        if duration > self.longest:
+            self.longest = duration
+        if allocated > self.most_allocated:
+            self.most_allocated = allocated
+        if collected:
+            self.pauses += 1
+            if duration > self.longest_pause:
+                self.longest_pause = duration
+
+    def report_line(self):
+        """ Prints the totals of the subsystem """
+        average = self.total // self.calls if self.calls else 0
+        print('{:<10}{:>8}{:>10}{:>10}{:>11}{:>10}{:>11}'.format(self.name, self.calls, average, self.longest, self.most_allocated, self.pauses, self.longest_pause))
+
+    def report_samples(self):
+        """ Prints the recent calls of the subsystem, oldest first """
+        size = len(self._durations)
+        count = min(self.calls, size)
+        start = (self._next - count) % size
+        parts = []
+        for offset in range(count):
+            index = (start + offset) % size
+            allocated = self._allocations[index]
+            parts.append(str(self._durations[index]) + ('/*' if allocated < 0 else '/' + str(allocated)))
+        print(self.name + ':', ' '.join(parts))
+
+
+_missing = object()
+""" Marks the arguments not passed to a profiled method """
+
+_TICKS_MASK = (1 << 29) - 1
+""" supervisor.ticks_ms() wraps around at 2**29 """
+
+
+if ticks_ms is not None:
+    def _now():
+        """ Returns the time in milliseconds, as a small integer so reading it doesn't allocate memory """
+        return ticks_ms()
+
+    def _elapsed(start, end):
+        """
+        Returns the microseconds between two times from _now(). Only whole milliseconds are counted, so single calls
+        read as 0 or a multiple of 1000, but the average over many calls is still accurate
+        """
+        return ((end - start) & _TICKS_MASK) * 1000
+else:
+    def _now():
+        """ Returns the time in nanoseconds """
+        return time.monotonic_ns()
+
+    def _elapsed(start, end):
+        """ Returns the microseconds between two times from _now() """
+        return (end - start) // 1000
+
+
+def _no_mem_free():
+    """ Stands in for gc.mem_free() where it is not available, such as when simulated on a computer """
+    return 0
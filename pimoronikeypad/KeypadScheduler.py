@@ -0,0 +1,240 @@
+from .KeypadTicks import ticks_ms, ticks_add, ticks_diff
+
+
+"""
+KeypadScheduler
+================================================================================
+Provides a cooperative scheduler for the main loop, running short slices of
+each task in order of priority and measuring each slice against a budget, so
+slow LED or HID work shows up as overruns rather than as missed key presses
+"""
+
+class KeypadTask():
+    """ A function run repeatedly by the scheduler, with a priority and a budget """
+
+    def __init__(self, name, function, priority, budget, interval=0):
+        """
+        A function run repeatedly by the scheduler. Initialization sets the following properties:
+        - name
+        - function, called with no arguments for each slice of the task
+        - priority, where lower numbers run first
+        - budget, the time in microseconds a slice should take
+        - interval, the time in seconds between slices, 0 to run on every pass
+        """
+        self.name = name
+        self.function = function
+        self.priority = priority
+        self.budget = budget
+        self.interval = interval
+        self.next = ticks_ms()
+        self.reset()
+
+    @property
+    def priority(self):
+        """ The order the task runs in each pass, lower numbers run first """
+        return self._priority
+
+    @priority.setter
+    def priority(self, value):
+        if isinstance(value, int):
+            self._priority = value
+        else:
+            raise TypeError('priority must be an integer')
+
+    @priority.deleter
+    def priority(self):
+        raise AttributeError('Do not delete priority')
+
+    @property
+    def budget(self):
+        """ The time in microseconds a slice of the task should take """
+        return self._budget
+
+    @budget.setter
+    def budget(self, value):
+        if isinstance(value, int):
+            if value > 0:
+                self._budget = value
+            else:
+                raise ValueError('budget must be greater than 0')
+        else:
+            raise TypeError('budget must be an integer')
+
+    @budget.deleter
+    def budget(self):
+        raise AttributeError('Do not delete budget')
+
+    @property
+    def interval(self):
+        """ The time in seconds between slices of the task, 0 to run on every pass """
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        if isinstance(value, (int, float)):
+            if value >= 0:
+                self._interval = value
+                self._interval_ms = int(value * 1000)
+            else:
+                raise ValueError('interval must be 0 or greater')
+        else:
+            raise TypeError('interval must be a number')
+
+    @interval.deleter
+    def interval(self):
+        raise AttributeError('Do not delete interval')
+
+    def reset(self):
+        """ Clears the slices and overruns recorded so far """
+        self.runs = 0
+        self.total = 0
+        self.longest = 0
+        self.overruns = 0
+        self.worst_overrun = 0
+
+    def is_due(self, now):
+        """ Returns whether a slice of the task is due at the given time from ticks_ms() """
+        return not self._interval_ms or ticks_diff(now, self.next) >= 0
+
+    def run(self, now):
+        """
+        Runs a slice of the task, recording the time taken against the budget. Times are read from ticks_ms(), which
+        never allocates memory, so the time taken is measured in whole milliseconds
+        """
+        if self._interval_ms:
+            # Keep to the interval, unless too far behind to catch up
+            self.next = ticks_add(self.next, self._interval_ms)
+            if ticks_diff(self.next, now) < 0:
+                self.next = ticks_add(now, self._interval_ms)
+        start = ticks_ms()
+        self.function()
+        duration = ticks_diff(ticks_ms(), start) * 1000
+        self.runs += 1
+        self.total += duration
+        if duration > self.longest:
+            self.longest = duration
+        if duration > self.budget:
+            self.overruns += 1
+            if duration - self.budget > self.worst_overrun:
+                self.worst_overrun = duration - self.budget
+
+
+class KeypadScheduler():
+    """ Runs the tasks of the main loop in slices, in order of priority """
+
+    def __init__(self, report_interval=None):
+        """
+        Runs the tasks of the main loop in slices, in order of priority. Initialization sets the following properties:
+        - tasks, in the order they run
+        - report_interval, the time in seconds between reports printed by run(), None to never print them
+        """
+        self._tasks = []
+        self.report_interval = report_interval
+
+    @classmethod
+    def for_keypad(cls, keypad, serial=None, report_interval=None):
+        """ Returns a scheduler running the main loop of the keypad, and of its KeypadSerial if given """
+        scheduler = cls(report_interval)
+
+        def housekeeping():
+            # Persist the keypad state, only written to flash periodically while idle
+            keypad.save_state()
+
+            # Handle any packets sent from the computer over serial
+            if serial is not None:
+                serial.poll()
+
+        # Scanning runs first, and again before any other task once its interval has passed,
+        # so queued text or effects never hold up reading the keys
+        scheduler.add('scan', keypad.handle_presses, priority=0, budget=2000, interval=0.001)
+
+        # Send the next slice of any queued keyboard shortcuts or text
+        scheduler.add('hid', keypad.send_actions, priority=1, budget=5000)
+
+        # Render the next frame of the effect, if one has been set
+        scheduler.add('animation', keypad.animate, priority=2, budget=5000)
+
+        scheduler.add('housekeeping', housekeeping, priority=3, budget=3000)
+        return scheduler
+
+    @property
+    def tasks(self):
+        """ The tasks of the scheduler, in the order they run """
+        return self._tasks
+
+    @tasks.deleter
+    def tasks(self):
+        raise AttributeError('Do not delete tasks')
+
+    @property
+    def report_interval(self):
+        """ The time in seconds between reports printed by run(), None to never print them """
+        return self._report_interval
+
+    @report_interval.setter
+    def report_interval(self, value):
+        if value is None or isinstance(value, (int, float)):
+            self._report_interval = value
+        else:
+            raise TypeError('report_interval must be a number or None type')
+
+    @report_interval.deleter
+    def report_interval(self):
+        raise AttributeError('Do not delete report_interval')
+
+    def add(self, name, function, priority, budget, interval=0):
+        """ Adds a task, returning the KeypadTask object """
+        task = KeypadTask(name, function, priority, budget, interval)
+        self._tasks.append(task)
+        self._tasks.sort(key=lambda task: task.priority)
+        return task
+
+    def get_task(self, name):
+        """ Returns the task with the given name """
+        for task in self._tasks:
+            if task.name == name:
+                return task
+        raise ValueError('No task named ' + repr(name))
+
+    def run_once(self):
+        """
+        Runs a single pass, a slice of each due task in order of priority. Before each slice, any higher priority task
+        running on an interval that has come due runs again, so the wait for the first task is never longer than the
+        longest slice of any other
+        """
+        tasks = self._tasks
+        for position in range(len(tasks)):
+            for higher in range(position):
+                task = tasks[higher]
+                now = ticks_ms()
+                if task.interval and task.is_due(now):
+                    task.run(now)
+            task = tasks[position]
+            now = ticks_ms()
+            if task.is_due(now):
+                task.run(now)
+
+    def run(self):
+        """ Runs passes forever, printing the report every report_interval seconds if set """
+        report_interval = int((self.report_interval or 0) * 1000)
+        report_next = ticks_add(ticks_ms(), report_interval)
+        while True:
+            self.run_once()
+            if report_interval and ticks_diff(ticks_ms(), report_next) >= 0:
+                report_next = ticks_add(report_next, report_interval)
+                self.report()
+
+    def reset(self):
+        """ Clears the slices and overruns recorded so far """
+        for task in self._tasks:
+            task.reset()
+
+    def report(self):
+        """ Prints the slices, time, and budget overruns of each task """
+        print('{:<13}{:>9}{:>8}{:>10}{:>10}{:>10}{:>11}'.format('task', 'priority', 'budget', 'slices', 'avg us', 'max us', 'overruns'))
+        for task in self._tasks:
+            average = task.total // task.runs if task.runs else 0
+            print('{:<13}{:>9}{:>8}{:>10}{:>10}{:>10}{:>11}'.format(task.name, task.priority, task.budget, task.runs, average, task.longest, task.overruns))
+        for task in self._tasks:
+            if task.overruns:
+                print(task.name + ': ' + str(task.overruns) + ' of ' + str(task.runs) + ' slices over budget, by up to ' + str(task.worst_overrun) + 'us')
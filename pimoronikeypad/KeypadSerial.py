@@ -0,0 +1,376 @@
+"""
+KeypadSerial
+================================================================================
+Provides a compact binary protocol over the usb_cdc data serial port, allowing
+a computer to push LED frames, run commands, switch layers and read counters.
+
+Each packet is made up of:
+    0xA5 | command | length | payload (length bytes) | checksum
+
+where the checksum is the XOR of the command, length and payload bytes. Replies
+use the same format, with the command that is being replied to | 0x80
+"""
+
+class KeypadSerial():
+    """ A binary control protocol for a Pimoroni keypad over usb_cdc serial """
+
+    SYNC = 0xA5
+    """ The byte that starts every packet """
+
+    FRAME = 0x01
+    """ Shows a frame, payload is red, green, blue for each of the 16 keys with an optional brightness (0-255) """
+
+    RUN = 0x02
+    """ Runs a command, payload is x, y, command index. Replies with a status byte """
+
+    LAYER = 0x03
+    """ Toggles on a programmed key, payload is x, y with an optional brightness (0-255), or 0xFF to reset. Replies with a status byte """
+
+    COUNTERS = 0x04
+    """ Reads the usage counters of a key's commands, payload is x, y. Replies with x, y, then a 16 bit count per command """
+
+    PING = 0x05
+    """ Checks the keypad is listening. Replies with the protocol version """
+
+    SUBSCRIBE = 0x06
+    """ Turns key events on (1) or off (0), payload is a single byte. Replies with a status byte """
+
+    PROFILE = 0x07
+    """ Prints the profiling report to the console, when profiling is enabled. Replies with a status byte """
+
+    KEYS = 0x08
+    """ Shows a frame on some of the keys, payload is a 16 bit mask of the keys (bit 0 is key 0, high byte first) then as FRAME, the other keys keep their own colours """
+
+    KEY_EVENT = 0x40
+    """ Sent by the keypad when a key is pressed or released while subscribed, payload is the key index and 1 if pressed or 0 if released """
+
+    ERROR = 0x7F
+    """ Sent in reply to a packet that could not be handled, payload is the command and a status byte """
+
+    REPLY = 0x80
+    """ Added to the command of a packet to form the command of its reply """
+
+    VERSION = 3
+    """ The version of the protocol """
+
+    # Status bytes used in replies
+    OK = 0x00
+    BAD_CHECKSUM = 0x01
+    BAD_COMMAND = 0x02
+    BAD_PAYLOAD = 0x03
+    BAD_KEY = 0x04
+
+    FRAME_SIZE = 48
+    """ The number of bytes in a frame, red, green and blue for each key """
+
+    # States of the packet parser
+    _WAIT_SYNC = 0
+    _WAIT_COMMAND = 1
+    _WAIT_LENGTH = 2
+    _WAIT_PAYLOAD = 3
+    _WAIT_CHECKSUM = 4
+
+    def __init__(self, keypad, serial=None, buffer_size=256, max_bytes=128):
+        """
+        A binary control protocol for a Pimoroni keypad over usb_cdc serial. Initialization sets the following properties:
+        - keypad
+        - serial
+        - max_bytes
+
+        When no serial port is given the usb_cdc data port is used, which must be enabled in boot.py
+        """
+        if serial is None:
+            import usb_cdc
+            serial = usb_cdc.data
+        if serial is not None:
+            serial.timeout = 0
+        self.keypad = keypad
+        self.serial = serial
+        self.max_bytes = max_bytes
+
+        # Buffers are allocated once, nothing is allocated while parsing
+        self._ring = bytearray(buffer_size)
+        self._head = 0
+        self._tail = 0
+        self._chunk = bytearray(64)
+        self._payload = bytearray(255)
+        self._frame = bytearray(self.FRAME_SIZE)
+        self._frame_brightness = -1
+        self._frame_mask = 0xFFFF
+        self._frame_pending = False
+        self._reply = bytearray(260)
+        self._reply_views = {}
+        self._event = bytearray(2)
+        self._subscribed = False
+        self._pressed = 0
+
+        self._state = self._WAIT_SYNC
+        self._command = 0
+        self._length = 0
+        self._received = 0
+        self._checksum = 0
+
+    @property
+    def keypad(self):
+        """ The keypad controlled by the protocol """
+        return self._keypad
+
+    @keypad.setter
+    def keypad(self, value):
+        if value is not None:
+            self._keypad = value
+        else:
+            raise TypeError('keypad must be a PimoroniKeypad object')
+
+    @keypad.deleter
+    def keypad(self):
+        raise AttributeError('Do not delete keypad')
+
+    @property
+    def serial(self):
+        """ The serial port packets are read from, None if the data port has not been enabled """
+        return self._serial
+
+    @serial.setter
+    def serial(self, value):
+        self._serial = value
+
+    @serial.deleter
+    def serial(self):
+        raise AttributeError('Do not delete serial')
+
+    @property
+    def max_bytes(self):
+        """ The maximum number of bytes parsed by each call to poll() """
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        if isinstance(value, int):
+            if value > 0:
+                self._max_bytes = value
+            else:
+                raise ValueError('max_bytes must be greater than 0')
+        else:
+            raise TypeError('max_bytes must be an integer')
+
+    @max_bytes.deleter
+    def max_bytes(self):
+        raise AttributeError('Do not delete max_bytes')
+
+    @property
+    def buffered(self):
+        """ The number of bytes waiting in the ring buffer """
+        return (self._head - self._tail) % len(self._ring)
+
+    def poll(self):
+        """ Reads waiting bytes into the ring buffer and handles any complete packets, call once per loop """
+        if self._serial is None:
+            return
+        self._read()
+        self._parse()
+        if self._subscribed:
+            self._send_key_events()
+
+        # Only the latest frame received is shown
+        if self._frame_pending:
+            self._frame_pending = False
+            brightness = None if self._frame_brightness < 0 else self._frame_brightness / 255
+            self._keypad.show_frame(self._frame, brightness, self._frame_mask)
+
+    def send(self, command, payload=b'', length=None):
+        """ Sends a packet to the computer """
+        if length is None:
+            length = len(payload)
+        reply = self._reply
+        reply[0] = self.SYNC
+        reply[1] = command
+        reply[2] = length
+        checksum = command ^ length
+        for index in range(length):
+            reply[3 + index] = payload[index]
+            checksum ^= payload[index]
+        reply[3 + length] = checksum
+
+        # A view of the reply is kept for each packet size sent, so sending again doesn't allocate
+        view = self._reply_views.get(length)
+        if view is None:
+            view = memoryview(reply)[:length + 4]
+            self._reply_views[length] = view
+        self._serial.write(view)
+
+    def _send_key_events(self):
+        """ Sends an event for each key that has been pressed or released since the last poll """
+        event = self._event
+        keys = self._keypad.keys
+        for index in range(len(keys)):
+            pressed = 1 << index if keys[index].is_pressed else 0
+            if pressed != self._pressed & (1 << index):
+                self._pressed ^= 1 << index
+                event[0] = index
+                event[1] = 1 if pressed else 0
+                self.send(self.KEY_EVENT, event, 2)
+
+    def _read(self):
+        """ Copies waiting bytes from the serial port into the ring buffer, while there is room """
+        ring = self._ring
+        size = len(ring)
+        chunk = self._chunk
+        while self._serial.in_waiting:
+            # Only read while a whole chunk fits, otherwise the bytes are left waiting in the port
+            if size - 1 - self.buffered < len(chunk):
+                return
+            count = self._serial.readinto(chunk)
+            if not count:
+                return
+            head = self._head
+            for index in range(count):
+                ring[head] = chunk[index]
+                head += 1
+                if head == size:
+                    head = 0
+            self._head = head
+
+    def _parse(self):
+        """ Steps the packet state machine through the bytes in the ring buffer """
+        ring = self._ring
+        size = len(ring)
+        remaining = self._max_bytes
+        while self._tail != self._head and remaining:
+            byte = ring[self._tail]
+            self._tail += 1
+            if self._tail == size:
+                self._tail = 0
+            remaining -= 1
+
+            state = self._state
+            if state == self._WAIT_SYNC:
+                if byte == self.SYNC:
+                    self._state = self._WAIT_COMMAND
+            elif state == self._WAIT_COMMAND:
+                self._command = byte
+                self._checksum = byte
+                self._state = self._WAIT_LENGTH
+            elif state == self._WAIT_LENGTH:
+                self._length = byte
+                self._received = 0
+                self._checksum ^= byte
+                self._state = self._WAIT_PAYLOAD if byte else self._WAIT_CHECKSUM
+            elif state == self._WAIT_PAYLOAD:
+                self._payload[self._received] = byte
+                self._received += 1
+                self._checksum ^= byte
+                if self._received == self._length:
+                    self._state = self._WAIT_CHECKSUM
+            else:
+                self._state = self._WAIT_SYNC
+                if byte == self._checksum:
+                    self._handle(self._command, self._payload, self._length)
+                else:
+                    self._send_status(self.ERROR, self._command, self.BAD_CHECKSUM)
+
+    def _handle(self, command, payload, length):
+        """ Handles a complete packet """
+        if command == self.FRAME:
+            if length != self.FRAME_SIZE and length != self.FRAME_SIZE + 1:
+                self._send_status(self.ERROR, command, self.BAD_PAYLOAD)
+                return
+            frame = self._frame
+            for index in range(self.FRAME_SIZE):
+                frame[index] = payload[index]
+            self._frame_brightness = payload[self.FRAME_SIZE] if length > self.FRAME_SIZE else -1
+            self._frame_mask = 0xFFFF
+            self._frame_pending = True
+
+        elif command == self.KEYS:
+            if length != self.FRAME_SIZE + 2 and length != self.FRAME_SIZE + 3:
+                self._send_status(self.ERROR, command, self.BAD_PAYLOAD)
+                return
+            frame = self._frame
+            for index in range(self.FRAME_SIZE):
+                frame[index] = payload[2 + index]
+            self._frame_brightness = payload[2 + self.FRAME_SIZE] if length > self.FRAME_SIZE + 2 else -1
+            self._frame_mask = payload[0] << 8 | payload[1]
+            self._frame_pending = True
+
+        elif command == self.RUN:
+            key = self._get_programmed_key(command, payload, length, 3)
+            if key is None:
+                return
+            if payload[2] >= len(key.commands):
+                self._send_status(self.ERROR, command, self.BAD_PAYLOAD)
+                return
+            self._send_status(command | self.REPLY, command, self.OK)
+            self._keypad.run_key_command(key, payload[2])
+
+        elif command == self.LAYER:
+            # The layer is newer than any frame waiting to be shown
+            self._frame_pending = False
+            if length >= 1 and payload[0] == 0xFF:
+                self._keypad.reset()
+                self._send_status(command | self.REPLY, command, self.OK)
+                return
+            key = self._get_programmed_key(command, payload, length, 2)
+            if key is None:
+                return
+            if length > 2:
+                self._keypad.toggle_on(key, brightness=payload[2] / 255)
+            else:
+                self._keypad.toggle_on(key)
+            self._send_status(command | self.REPLY, command, self.OK)
+
+        elif command == self.COUNTERS:
+            key = self._get_programmed_key(command, payload, length, 2)
+            if key is None:
+                return
+            reply = self._payload
+            hits = self._keypad.command_hits(key)[:126]
+            for index, count in enumerate(hits):
+                if count > 0xFFFF:
+                    count = 0xFFFF
+                reply[2 + index * 2] = count >> 8
+                reply[3 + index * 2] = count & 0xFF
+            self.send(command | self.REPLY, reply, 2 + len(hits) * 2)
+
+        elif command == self.SUBSCRIBE:
+            if length != 1:
+                self._send_status(self.ERROR, command, self.BAD_PAYLOAD)
+                return
+            self._subscribed = payload[0] != 0
+            self._pressed = 0
+            self._send_status(command | self.REPLY, command, self.OK)
+
+        elif command == self.PROFILE:
+            if self._keypad.profiler is None:
+                self._send_status(self.ERROR, command, self.BAD_COMMAND)
+                return
+            self._send_status(command | self.REPLY, command, self.OK)
+            self._keypad.profiler.report()
+
+        elif command == self.PING:
+            self._payload[0] = self.VERSION
+            self.send(command | self.REPLY, self._payload, 1)
+
+        else:
+            self._send_status(self.ERROR, command, self.BAD_COMMAND)
+
+    def _get_programmed_key(self, command, payload, length, minimum_length):
+        """ Returns the programmed key at the x, y coordinates that start the payload, replying with an error if there is not one """
+        if length < minimum_length:
+            self._send_status(self.ERROR, command, self.BAD_PAYLOAD)
+            return None
+        if payload[0] > 3 or payload[1] > 3:
+            self._send_status(self.ERROR, command, self.BAD_KEY)
+            return None
+        key = self._keypad.get_key(payload[0], payload[1])
+        if not key.is_programmed:
+            self._send_status(self.ERROR, command, self.BAD_KEY)
+            return None
+        return key
+
+    def _send_status(self, reply_command, command, status):
+        """ Sends a reply made up of the command being replied to and a status byte """
+        reply = self._payload
+        reply[0] = command
+        reply[1] = status
+        self.send(reply_command, reply, 2)
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+
+
+"""
+KeypadStore
+================================================================================
+Provides a small key-value store kept on the CIRCUITPY drive. Changes are held
+in memory and written in batches, appended to a log file that is compacted once
+it grows too large, keeping the number of writes to flash low
+"""
+
+class KeypadStore():
+    """ A key-value store persisted as a log of changes in a file """
+
+    def __init__(self, path=None, flush_interval=60.0, compact_size=4096):
+        """
+        A key-value store persisted as a log of changes in a file. Initialization sets the following properties:
+        - path
+        - flush_interval
+        - compact_size
+
+        When path is None the values are only kept in memory
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_size = compact_size
+        self._values = {}
+        self._dirty = set()
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self.load()
+
+    @property
+    def path(self):
+        """ The path of the log file on the drive, or None if values are not persisted """
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        if isinstance(value, str) or value is None:
+            self._path = value
+        else:
+            raise TypeError('path must be a string or None type')
+
+    @path.deleter
+    def path(self):
+        raise AttributeError('Do not delete path')
+
+    @property
+    def flush_interval(self):
+        """ The minimum number of seconds between writes to the drive """
+        return self._flush_interval
+
+    @flush_interval.setter
+    def flush_interval(self, value):
+        if isinstance(value, (int, float)):
+            if value >= 0:
+                self._flush_interval = value
+            else:
+                raise ValueError('flush_interval must not be negative')
+        else:
+            raise TypeError('flush_interval must be a number')
+
+    @flush_interval.deleter
+    def flush_interval(self):
+        raise AttributeError('Do not delete flush_interval')
+
+    @property
+    def compact_size(self):
+        """ The size in bytes the log file can reach before it is compacted """
+        return self._compact_size
+
+    @compact_size.setter
+    def compact_size(self, value):
+        if isinstance(value, int):
+            if value > 0:
+                self._compact_size = value
+            else:
+                raise ValueError('compact_size must be greater than 0')
+        else:
+            raise TypeError('compact_size must be an integer')
+
+    @compact_size.deleter
+    def compact_size(self):
+        raise AttributeError('Do not delete compact_size')
+
+    @property
+    def is_dirty(self):
+        """ Whether there are changes that have not yet been written to the drive """
+        return len(self._dirty) > 0
+
+    @property
+    def is_due(self):
+        """ Whether enough time has passed since the last write for the changes to be written """
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def load(self):
+        """ Reads the values from the log file, each line of the log is a [key, value] pair """
+        self._values = {}
+        self._dirty = set()
+        self._size = 0
+        if self.path is None:
+            return
+        path = self.path
+        if not self._exists(path):
+            # A compaction was interrupted after the old log was removed
+            path = self.path + '.tmp'
+            if not self._exists(path):
+                return
+        with open(path) as file:
+            for line in file:
+                self._size += len(line)
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    # A partially written line, left by losing power during a write
+                    continue
+                self._values[key] = value
+        if path != self.path:
+            # Finish the interrupted compaction, so the next flush doesn't start a new log without these values
+            try:
+                os.rename(path, self.path)
+            except OSError:
+                # The drive is read only, write every value to the new log with the next flush instead
+                self._dirty = set(self._values)
+
+    def get(self, key, default=None):
+        """ Returns the value stored with the given key """
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        """ Stores the value with the given key, the change is written by the next flush """
+        if key not in self._values or self._values[key] != value:
+            self._values[key] = value
+            self._dirty.add(key)
+
+    def increment(self, key, amount=1):
+        """ Adds the amount to the counter stored with the given key, and returns the new count """
+        count = self._values.get(key, 0) + amount
+        self._values[key] = count
+        self._dirty.add(key)
+        return count
+
+    def keys(self):
+        """ Returns a list of the keys in the store """
+        return list(self._values)
+
+    def flush(self, force=False):
+        """ Writes any changes to the drive once the flush interval has passed, returns whether anything was written """
+        if not self._dirty or self.path is None:
+            return False
+        if not force and not self.is_due:
+            return False
+        self._last_flush = time.monotonic()
+        try:
+            if self._size >= self.compact_size:
+                self.compact()
+            else:
+                with open(self.path, 'a') as file:
+                    for key in self._dirty:
+                        line = json.dumps([key, self._values[key]]) + '\n'
+                        file.write(line)
+                        self._size += len(line)
+        except OSError as error:
+            # The drive is read only unless remounted in boot.py, keep the values in memory
+            print('KeypadStore could not write to', self.path, error)
+            return False
+        self._dirty = set()
+        return True
+
+    def compact(self):
+        """ Rewrites the log file with a single line for each key """
+        if self.path is None:
+            return
+        temporary_path = self.path + '.tmp'
+        size = 0
+        with open(temporary_path, 'w') as file:
+            for key in self._values:
+                line = json.dumps([key, self._values[key]]) + '\n'
+                file.write(line)
+                size += len(line)
+        if self._exists(self.path):
+            os.remove(self.path)
+        os.rename(temporary_path, self.path)
+        self._size = size
+        self._dirty = set()
+
+    def _exists(self, path):
+        """ Returns whether a file exists at the given path """
+        try:
+            os.stat(path)
+            return True
+        except OSError:
+            return False
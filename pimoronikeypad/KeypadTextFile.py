@@ -0,0 +1,88 @@
+"""
+KeypadTextFile
+================================================================================
+Provides the text of a file on the CIRCUITPY drive a character at a time,
+read through a small fixed buffer and decoded from UTF-8 as it goes, so text of
+any length can be typed without holding it in memory
+"""
+
+class KeypadTextFile():
+    """ A UTF-8 text file read a character at a time """
+
+    def __init__(self, path, buffer_size=64):
+        """
+        A UTF-8 text file read a character at a time. Initialization sets the following property:
+        - path
+
+        The file is not opened until the first character is read
+        """
+        self.path = path
+        self._buffer = bytearray(buffer_size)
+        self._position = 0
+        self._length = 0
+        self._file = None
+
+    @property
+    def path(self):
+        """ The path of the file """
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        if isinstance(value, str):
+            self._path = value
+        else:
+            raise TypeError('path must be a string')
+
+    @path.deleter
+    def path(self):
+        raise AttributeError('Do not delete path')
+
+    def read(self):
+        """ Returns the code point of the next character, or -1 at the end of the file """
+        while True:
+            byte = self._read_byte()
+            if byte < 0x80:
+                code_point = byte
+                remaining = 0
+            elif byte >= 0xF0:
+                code_point = byte & 0x07
+                remaining = 3
+            elif byte >= 0xE0:
+                code_point = byte & 0x0F
+                remaining = 2
+            elif byte >= 0xC0:
+                code_point = byte & 0x1F
+                remaining = 1
+            else:
+                raise ValueError(self.path + ' is not valid UTF-8')
+
+            # A character can be split across two reads of the buffer
+            for _ in range(remaining):
+                byte = self._read_byte()
+                if byte & 0xC0 != 0x80:
+                    raise ValueError(self.path + ' is not valid UTF-8')
+                code_point = code_point << 6 | byte & 0x3F
+
+            # Carriage returns of Windows line endings, and byte order marks, aren't typed
+            if code_point != 0x0D and code_point != 0xFEFF:
+                return code_point
+
+    def close(self):
+        """ Closes the file """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_byte(self):
+        """ Returns the next byte, refilling the buffer from the file when it runs out, or -1 at the end of the file """
+        if self._position >= self._length:
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._length = self._file.readinto(self._buffer) or 0
+            self._position = 0
+            if not self._length:
+                return -1
+        byte = self._buffer[self._position]
+        self._position += 1
+        return byte
@@ -0,0 +1,49 @@
+import time
+
+try:
+    from supervisor import ticks_ms as _supervisor_ticks_ms
+except ImportError:
+    # Not available when simulated on a computer
+    _supervisor_ticks_ms = None
+
+
+"""
+KeypadTicks
+================================================================================
+Provides a millisecond clock for timing the main loop, read from
+supervisor.ticks_ms(). The ticks stay small integers, so reading and comparing
+them never allocates memory, and wrap around every 2**29 milliseconds, so
+times must be compared with ticks_diff() rather than directly
+"""
+
+TICKS_PERIOD = 1 << 29
+""" The number of milliseconds after which the ticks wrap around to 0 """
+
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+
+if _supervisor_ticks_ms is not None:
+    def ticks_ms():
+        """ Returns the time in milliseconds """
+        return _supervisor_ticks_ms()
+else:
+    def ticks_ms():
+        """ Returns the time in milliseconds, from time.monotonic_ns() when supervisor is not available """
+        return (time.monotonic_ns() // 1000000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    """ Returns the ticks the given number of milliseconds after ticks """
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(end, start):
+    """ Returns the milliseconds from start to end, negative when end is before start, correct across a wrap around """
+    diff = (end - start) & _TICKS_MAX
+    return ((diff + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+def ticks_less(first, second):
+    """ Returns whether the first ticks are before the second """
+    return ticks_diff(first, second) < 0
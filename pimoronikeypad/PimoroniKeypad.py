@@ -2,17 +2,15 @@ import time
 import json
 import board
 import busio
-import usb_hid
 
 from adafruit_bus_device.i2c_device import I2CDevice
-import adafruit_dotstar
-
-from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
-from adafruit_hid.keycode import Keycode
 
 from digitalio import DigitalInOut, Direction
 
+from .KeypadLayout import KeypadLayout
+from .KeypadStore import KeypadStore
+from .KeypadTicks import ticks_ms, ticks_add, ticks_diff
+
 
 """
 PimoroniKeypad
@@ -21,6 +19,13 @@ Provides functionality to load in config values, programmatically update the
 keypad, and enable the keypad to perform as a HID
 """
 
+class _KeycodeDictionary():
+    """ Loads the keycode dictionary the first time it is read, from the PimoroniKeypad class or a keypad """
+
+    def __get__(self, instance, owner):
+        return owner.get_keycode_dictionary()
+
+
 class PimoroniKeypad:
     """ An implementation of the Pimoroni Keypad using CircuitPython and adafruit """
     
@@ -31,156 +36,103 @@ class PimoroniKeypad:
     }
     """ A dictionary of preconfigured load animation patterns mapped to the value from the configuration """
 
-    keycode_dictionary = {
-            'alt': Keycode.ALT,
-            'application': Keycode.APPLICATION,
-            'backslash': Keycode.BACKSLASH,
-            'backspace': Keycode.BACKSPACE,
-            'capsLock': Keycode.CAPS_LOCK,
-            'comma': Keycode.COMMA,
-            'command': Keycode.COMMAND,
-            'control': Keycode.CONTROL,
-            'delete': Keycode.DELETE,
-            'downArrow': Keycode.DOWN_ARROW,
-            'end': Keycode.END,
-            'enter': Keycode.ENTER,
-            'equals': Keycode.EQUALS,
-            'escape': Keycode.ESCAPE,
-            'f1': Keycode.F1,
-            'f10': Keycode.F10,
-            'f11': Keycode.F11,
-            'f12': Keycode.F12,
-            'f13': Keycode.F13,
-            'f14': Keycode.F14,
-            'f15': Keycode.F15,
-            'f16': Keycode.F16,
-            'f17': Keycode.F17,
-            'f18': Keycode.F18,
-            'f19': Keycode.F19,
-            'f2': Keycode.F2,
-            'f20': Keycode.F20,
-            'f21': Keycode.F21,
-            'f22': Keycode.F22,
-            'f23': Keycode.F23,
-            'f24': Keycode.F24,
-            'f3': Keycode.F3,
-            'f4': Keycode.F4,
-            'f5': Keycode.F5,
-            'f6': Keycode.F6,
-            'f7': Keycode.F7,
-            'f8': Keycode.F8,
-            'f9': Keycode.F9,
-            'forwardSlash': Keycode.FORWARD_SLASH,
-            'four': Keycode.FOUR,
-            'graveAccent': Keycode.GRAVE_ACCENT,
-            'gui': Keycode.GUI,
-            'home': Keycode.HOME,
-            'insert': Keycode.INSERT,
-            'keypadAsterisk': Keycode.KEYPAD_ASTERISK,
-            'keypadBackslash': Keycode.KEYPAD_BACKSLASH,
-            'numlock': Keycode.KEYPAD_NUMLOCK,
-            'plus': Keycode.KEYPAD_PLUS,
-            'leftAlt': Keycode.LEFT_ALT,
-            'leftArrow': Keycode.LEFT_ARROW,
-            'leftBracket': Keycode.LEFT_BRACKET,
-            'leftControl': Keycode.LEFT_CONTROL,
-            'leftGui': Keycode.LEFT_GUI,
-            'leftShift': Keycode.LEFT_SHIFT,
-            'minus': Keycode.MINUS,
-            'option': Keycode.OPTION,
-            'pageDown': Keycode.PAGE_DOWN,
-            'pageUp': Keycode.PAGE_UP,
-            'pause': Keycode.PAUSE,
-            'period': Keycode.PERIOD,
-            'pound': Keycode.POUND,
-            'power': Keycode.POWER,
-            'printScreen': Keycode.PRINT_SCREEN,
-            'quote': Keycode.QUOTE,
-            'return': Keycode.RETURN,
-            'rightAlt': Keycode.RIGHT_ALT,
-            'rightArrow': Keycode.RIGHT_ARROW,
-            'rightBracket': Keycode.RIGHT_BRACKET,
-            'rightControl': Keycode.RIGHT_CONTROL,
-            'rightGui': Keycode.RIGHT_GUI,
-            'rightShift': Keycode.RIGHT_SHIFT,
-            'scrollLock': Keycode.SCROLL_LOCK,
-            'semicolon': Keycode.SEMICOLON,
-            'shift': Keycode.SHIFT,
-            'space': Keycode.SPACE,
-            'spacebar': Keycode.SPACEBAR,
-            'tab': Keycode.TAB,
-            'upArrow': Keycode.UP_ARROW,
-            'windows': Keycode.WINDOWS,
-            'a': Keycode.A,
-            'b': Keycode.B,
-            'c': Keycode.C,
-            'd': Keycode.D,
-            'e': Keycode.E,
-            'f': Keycode.F,
-            'g': Keycode.G,
-            'h': Keycode.H,
-            'i': Keycode.I,
-            'j': Keycode.J,
-            'k': Keycode.K,
-            'l': Keycode.L,
-            'm': Keycode.M,
-            'n': Keycode.N,
-            'o': Keycode.O,
-            'p': Keycode.P,
-            'q': Keycode.Q,
-            'r': Keycode.R,
-            's': Keycode.S,
-            't': Keycode.T,
-            'u': Keycode.U,
-            'v': Keycode.V,
-            'w': Keycode.W,
-            'x': Keycode.X,
-            'y': Keycode.Y,
-            'z': Keycode.Z
-        }
-    """ A dictionary mapping values from the configuration to the corresponding keyboard keycode """
+    config_file = 'config.json'
+    """ The file the configuration is loaded from """
+
+    state_file = '/keypad_state.log'
+    """ The file on the CIRCUITPY drive the keypad state is persisted to """
+
+    shortcut_delay = 1.0
+    """ The time in seconds to wait after a keyboard shortcut before sending the next action """
+
+    text_delay = 0.5
+    """ The time in seconds to wait after typing text before sending the next action """
+
+    text_budget = 4000
+    """ The time in microseconds each call to send_actions() may spend typing text, counted in whole milliseconds, at least one character is always typed """
+
+    text_buffer_size = 64
+    """ The number of bytes read at a time from the files of enterText actions """
+
+    _keycode_dictionary = None
+    """ The keycode dictionary, shared between keypads once it has been loaded """
+
+    keycode_dictionary = _KeycodeDictionary()
+    """ A dictionary mapping values from the configuration to the corresponding keyboard keycode, loaded on first use """
     
     def __init__(self):
         """ An implementation of the Pimoroni Keypad using CircuitPython and adafruit """
 
-        # load data from config.json
-        self.config = self.load_config()
-        brightness = self.config['brightness']
-        config_colour = self.config['colour'] 
-        colour = RGB(config_colour['red'], config_colour['green'], config_colour['blue'])
-             
         # Pull CS pin low to enable level shifter
         self._cs = DigitalInOut(board.GP17)
         self._cs.direction = Direction.OUTPUT
         self._cs.value = 0
 
-        # Set up APA102 pixels
-        self._num_pixels = 16
-        self._pixels = adafruit_dotstar.DotStar(board.GP18, board.GP19, self._num_pixels, brightness=brightness, auto_write=True)
-
-        # Set up I2C for IO expander (addr: 0x20)
+        # Set up I2C for IO expander (addr: 0x20), first so keys can be scanned as early as possible
         self._i2c = busio.I2C(board.GP5, board.GP4)
         self._device = I2CDevice(self._i2c, 0x20)
 
-        # Set up the keyboard
-        self._kbd = Keyboard(usb_hid.devices)
-        self._layout = KeyboardLayoutUS(self._kbd)
+        # load data from config.json
+        self.config = self.load_config()
+        brightness = self.config['brightness']
+        config_colour = self.config['colour'] 
+        colour = RGB(config_colour['red'], config_colour['green'], config_colour['blue'])
+        fast_start = self.config.get('fastStart', False)
+
+        # The keyboard is set up on first use, so its layout is checked now rather than when the first command runs
+        if self.config.get('keyboardLayout', 'us') not in KeypadLayout.layouts:
+            raise ValueError('keyboardLayout must be one of: ' + ', '.join(KeypadLayout.layouts))
+        if self.config.get('persistState', False):
+            self.store = KeypadStore(self.state_file)
+        else:
+            self.store = KeypadStore()
+
+        # The APA102 pixels and the keyboard are set up on first use
+        self._num_pixels = 16
+        self._pixels = None
+        self._kbd = None
+        self._layout = None
+        self._loader = None
+        self._load_next = None
+        self._effect = None
+        self._effect_next = None
+        self._frame = bytearray(self._num_pixels * 3)
+        self._input_register = bytes([0x0])
+        self._inputs = bytearray(2)
+        self._actions = []
+        self._action_position = 0
+        self._action_next = None
+        self._text_file = None
+        self.profiler = None
         
         # Set up values
         self.keys = []
         self.default_colour = colour
-        self.colour = colour        
+        self._colour = colour        
         self.default_brightness = brightness
-        self.brightness = brightness        
+        self._brightness = brightness        
         self.is_toggled_on = False        
         self.toggled_key = None
+        self._page = 0
+        page_colour = self.config.get('pageColour', {'red': 255, 'green': 255, 'blue': 255})
+        self.page_colour = RGB(page_colour['red'], page_colour['green'], page_colour['blue'])
         
         # Set up keys
         for row in range(4):
             for col in range(4):
                 self.keys.append(KeypadKey(self, row, col, brightness=brightness))
         self.set_key_config()
-        self.load()
+
+        # Colours set on keys at runtime are persisted when they differ from the configuration
+        self._configured_colours = [key.master_colour.value for key in self.keys]
+        if self.config.get('profile', False):
+            # The profiler, effects and text files are only imported when used, as each module is compiled on import
+            from .KeypadProfiler import KeypadProfiler
+            self.profiler = KeypadProfiler()
+            self.profiler.attach(self)
+        self.load(background=fast_start)
+        if not fast_start:
+            self.restore_state()
 
     @property
     def config(self):
@@ -322,13 +274,206 @@ class PimoroniKeypad:
     def toggled_key(self):
         raise AttributeError('Do not delete toggled_key')
 
+    @property
+    def profiler(self):
+        """ The profiler recording calls to the keypad, or None when not profiling """
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, value):
+        if value is not None:
+            from .KeypadProfiler import KeypadProfiler
+        if value is None or isinstance(value, KeypadProfiler):
+            self._profiler = value
+        else:
+            raise TypeError('profiler must be a KeypadProfiler object or None type')
+
+    @profiler.deleter
+    def profiler(self):
+        raise AttributeError('Do not delete profiler')
+
+    @property
+    def effect(self):
+        """ The effect shown on the keypad while it is not toggled on, or None to show the colours of the keys """
+        return self._effect
+
+    @effect.setter
+    def effect(self, value):
+        if value is not None:
+            from .KeypadEffects import KeypadEffect
+        if value is None or isinstance(value, KeypadEffect):
+            self._effect = value
+            self._effect_next = None
+            self.update()
+        else:
+            raise TypeError('effect must be a KeypadEffect object or None type')
+
+    @effect.deleter
+    def effect(self):
+        raise AttributeError('Do not delete effect')
+
+    @property
+    def page_colour(self):
+        """ The colour of the keys that move between pages, for programmed keys with more commands than fit on the keypad """
+        return self._page_colour
+
+    @page_colour.setter
+    def page_colour(self, value):
+        if isinstance(value, RGB):
+            self._page_colour = value
+            # The keys' pages hold the colour, so are rebuilt when next used
+            for key in self.keys:
+                key._pages = None
+        else:
+            raise TypeError('page_colour must be an RGB object')
+
+    @page_colour.deleter
+    def page_colour(self):
+        raise AttributeError('Do not delete page_colour')
+
+    @property
+    def store(self):
+        """ The store holding the persisted state of the keypad and the command usage counters """
+        return self._store
+
+    @store.setter
+    def store(self, value):
+        if isinstance(value, KeypadStore):
+            self._store = value
+        else:
+            raise TypeError('store must be a KeypadStore object')
+
+    @store.deleter
+    def store(self):
+        raise AttributeError('Do not delete store')
+
+    @classmethod
+    def get_keycode_dictionary(cls):
+        """ Returns the dictionary mapping values from the configuration to the corresponding keyboard keycode, loaded on first use """
+        if PimoroniKeypad._keycode_dictionary is None:
+            PimoroniKeypad._keycode_dictionary = PimoroniKeypad._load_keycode_dictionary()
+        return PimoroniKeypad._keycode_dictionary
+
+    @staticmethod
+    def _load_keycode_dictionary():
+        """ Imports the keycodes and returns the dictionary mapping values from the configuration to them """
+        from adafruit_hid.keycode import Keycode
+
+        return {
+            'alt': Keycode.ALT,
+            'application': Keycode.APPLICATION,
+            'backslash': Keycode.BACKSLASH,
+            'backspace': Keycode.BACKSPACE,
+            'capsLock': Keycode.CAPS_LOCK,
+            'comma': Keycode.COMMA,
+            'command': Keycode.COMMAND,
+            'control': Keycode.CONTROL,
+            'delete': Keycode.DELETE,
+            'downArrow': Keycode.DOWN_ARROW,
+            'end': Keycode.END,
+            'enter': Keycode.ENTER,
+            'equals': Keycode.EQUALS,
+            'escape': Keycode.ESCAPE,
+            'f1': Keycode.F1,
+            'f10': Keycode.F10,
+            'f11': Keycode.F11,
+            'f12': Keycode.F12,
+            'f13': Keycode.F13,
+            'f14': Keycode.F14,
+            'f15': Keycode.F15,
+            'f16': Keycode.F16,
+            'f17': Keycode.F17,
+            'f18': Keycode.F18,
+            'f19': Keycode.F19,
+            'f2': Keycode.F2,
+            'f20': Keycode.F20,
+            'f21': Keycode.F21,
+            'f22': Keycode.F22,
+            'f23': Keycode.F23,
+            'f24': Keycode.F24,
+            'f3': Keycode.F3,
+            'f4': Keycode.F4,
+            'f5': Keycode.F5,
+            'f6': Keycode.F6,
+            'f7': Keycode.F7,
+            'f8': Keycode.F8,
+            'f9': Keycode.F9,
+            'forwardSlash': Keycode.FORWARD_SLASH,
+            'four': Keycode.FOUR,
+            'graveAccent': Keycode.GRAVE_ACCENT,
+            'gui': Keycode.GUI,
+            'home': Keycode.HOME,
+            'insert': Keycode.INSERT,
+            'keypadAsterisk': Keycode.KEYPAD_ASTERISK,
+            'keypadBackslash': Keycode.KEYPAD_BACKSLASH,
+            'numlock': Keycode.KEYPAD_NUMLOCK,
+            'plus': Keycode.KEYPAD_PLUS,
+            'leftAlt': Keycode.LEFT_ALT,
+            'leftArrow': Keycode.LEFT_ARROW,
+            'leftBracket': Keycode.LEFT_BRACKET,
+            'leftControl': Keycode.LEFT_CONTROL,
+            'leftGui': Keycode.LEFT_GUI,
+            'leftShift': Keycode.LEFT_SHIFT,
+            'minus': Keycode.MINUS,
+            'option': Keycode.OPTION,
+            'pageDown': Keycode.PAGE_DOWN,
+            'pageUp': Keycode.PAGE_UP,
+            'pause': Keycode.PAUSE,
+            'period': Keycode.PERIOD,
+            'pound': Keycode.POUND,
+            'power': Keycode.POWER,
+            'printScreen': Keycode.PRINT_SCREEN,
+            'quote': Keycode.QUOTE,
+            'return': Keycode.RETURN,
+            'rightAlt': Keycode.RIGHT_ALT,
+            'rightArrow': Keycode.RIGHT_ARROW,
+            'rightBracket': Keycode.RIGHT_BRACKET,
+            'rightControl': Keycode.RIGHT_CONTROL,
+            'rightGui': Keycode.RIGHT_GUI,
+            'rightShift': Keycode.RIGHT_SHIFT,
+            'scrollLock': Keycode.SCROLL_LOCK,
+            'semicolon': Keycode.SEMICOLON,
+            'shift': Keycode.SHIFT,
+            'space': Keycode.SPACE,
+            'spacebar': Keycode.SPACEBAR,
+            'tab': Keycode.TAB,
+            'upArrow': Keycode.UP_ARROW,
+            'windows': Keycode.WINDOWS,
+            'a': Keycode.A,
+            'b': Keycode.B,
+            'c': Keycode.C,
+            'd': Keycode.D,
+            'e': Keycode.E,
+            'f': Keycode.F,
+            'g': Keycode.G,
+            'h': Keycode.H,
+            'i': Keycode.I,
+            'j': Keycode.J,
+            'k': Keycode.K,
+            'l': Keycode.L,
+            'm': Keycode.M,
+            'n': Keycode.N,
+            'o': Keycode.O,
+            'p': Keycode.P,
+            'q': Keycode.Q,
+            'r': Keycode.R,
+            's': Keycode.S,
+            't': Keycode.T,
+            'u': Keycode.U,
+            'v': Keycode.V,
+            'w': Keycode.W,
+            'x': Keycode.X,
+            'y': Keycode.Y,
+            'z': Keycode.Z
+        }
+
     def load_config(self):
         """ Open config.json file and extract data """
-        with open('config.json') as file:
+        with open(self.config_file) as file:
             return json.load(file)
 
     def set_key_config(self):
-        """ Populate keys with commands from configuration """
+        """ Populate keys with commands from configuration, the commands are built when the key is first used """
         config_object = self._config['config']            
         
         # Iterate through configured keys
@@ -337,36 +482,61 @@ class PimoroniKeypad:
             colour = button_object['colour']
             key.master_colour = RGB(colour['red'], colour['green'], colour['blue'])
             key.is_programmed = True
-            
-            # Populate the key's commands
-            for command_object in button_object['commands']:
-                command = KeypadCommand()                 
-                for action_object in command_object:
-                    command.actions.append(KeypadAction(action_object['actionType'], action_object['action']))                    
-                key.commands.append(command)            
+            key.load_commands(button_object['commands'])
 
     def load_pressed_keys(self):
         """ Reads and updates the current state of each key, and returns a list """
+        any_pressed = False
         with self._device:
             
             # Read from IO expander, 2 bytes (8 bits) correspond to the 16 buttons
-            self._device.write(bytes([0x0]))
-            result = bytearray(2)
+            self._device.write(self._input_register)
+            result = self._inputs
             self._device.readinto(result)
             b = result[0] | result[1] << 8
             
-            # Iterate each key and update
-            for index, key in enumerate(self.keys):
+            # Iterate each key and update, using buffers allocated once so scanning allocates no memory
+            keys = self._keys
+            for index in range(len(keys)):
+                key = keys[index]
                 if not (1 << index) & b:                    
                     if key.is_pressed:
                         key.still_pressed = True
                     else:
                         key.still_pressed = False                        
+                        if self._effect is not None:
+                            self._effect.press(index, ticks_ms())
                     key.is_pressed = True
+                    any_pressed = True
                 else:
                     key.still_pressed = False
                     key.is_pressed = False                    
-            return self.keys
+
+        # Continue the load animation, skipping it as soon as a key is pressed
+        if self._loader is not None:
+            self._step_load(any_pressed)
+        return self.keys
+
+    def handle_presses(self):
+        """ Reads the keys, and for each new press interrupts typing, runs a command, or toggles a key, call once per loop """
+        for key in self.load_pressed_keys():
+
+            # The still_pressed property checks that the key isn't still pressed from the last
+            # iteration, preventing multiple calls per single key press
+            if key.is_pressed and not key.still_pressed:
+
+                # A key press stops any text being typed, rather than running a command
+                if self.is_typing:
+                    self.cancel_actions()
+
+                elif self.is_toggled_on and not key.is_toggled_on:
+                    self.run_command(key)
+
+                elif key.is_toggled_on:
+                    self.reset()
+
+                elif key.is_programmed:
+                    self.toggle_on(key, brightness=1.0)
 
     def toggle_on(self, key, colour=None, brightness=None):
         """ Updates board to reflect the toggled, and programmed, keys """
@@ -374,6 +544,13 @@ class PimoroniKeypad:
             colour = self.default_colour
         if brightness is None:
             brightness = self.default_brightness        
+
+        # Switching straight from another programmed key turns that key off first
+        if self.toggled_key is not None:
+            previous_key = self.get_key(self.toggled_key[0], self.toggled_key[1])
+            previous_key.brightness = self.brightness
+            previous_key.is_toggled_on = False
+
         key.colour = colour
         key.brightness = brightness
         key.is_toggled_on = True
@@ -381,46 +558,195 @@ class PimoroniKeypad:
         self.is_toggled_on = True
         self.toggled_key = key.coordinates        
         
-        # Update keys
-        number_of_commands = len(key.commands)
-        current_key_index = self.coordinates_to_index(key.x, key.y)
-        if number_of_commands > current_key_index:
-            number_of_commands += 1        
-        self.keys[current_key_index].colour = key.master_colour 
+        # Update keys, showing the first page of commands
+        self.page = 0
+
+    @property
+    def page(self):
+        """ The index of the page of commands shown while toggled on """
+        return self._page
+
+    @page.setter
+    def page(self, value):
+        if isinstance(value, int):
+            pages = self._get_toggled_pages()
+            if 0 <= value < len(pages):
+                self._page = value
+                self._show_page(pages[value])
+            else:
+                raise ValueError('page must be between 0 and ' + str(len(pages) - 1) + ' inclusive')
+        else:
+            raise TypeError('page must be an integer')
+
+    @page.deleter
+    def page(self):
+        raise AttributeError('Do not delete page')
+
+    def run_command(self, key):
+        """ Extracts and runs the command associated with given key's index, or moves to the next or previous page """
+        toggled_key = self.get_key(self.toggled_key[0], self.toggled_key[1])
+        pages = toggled_key.pages
+        if self._page >= len(pages):
+            # The pages were rebuilt with fewer pages while toggled on, show the last page rather than guess the command
+            self.page = len(pages) - 1
+            return
+        entry = pages[self._page].dispatch[key.index]
+        if entry >= 0:
+            self.run_key_command(toggled_key, entry)
+        elif entry == KeypadPage.NEXT:
+            self.page = (self._page + 1) % len(pages)
+        elif entry == KeypadPage.PREVIOUS:
+            self.page = (self._page - 1) % len(pages)
+
+    def _get_toggled_pages(self):
+        """ Returns the pages of the toggled key """
+        if self.toggled_key is None:
+            raise ValueError('page can only be set while toggled on')
+        return self.get_key(self.toggled_key[0], self.toggled_key[1]).pages
+
+    def _show_page(self, page):
+        """ Sets the colour of each key from the precomputed page and updates the physical board """
+        colours = page.colours
+        default_colour = self.default_colour
         for key_index in range(16):
-            if key_index != current_key_index:
-                if key_index < number_of_commands:
-                    self.keys[key_index].colour = key.master_colour
-                else:
-                    self.keys[key_index].colour = self.default_colour
+            colour = colours[key_index]
+            self.keys[key_index].colour = default_colour if colour is None else colour
         self.update()
 
-    def run_command(self, key):
-        """ Extracts and runs the command associated with given key's index """
-        toggled_key_coordinates = self.toggled_key
-        toggled_key = self.get_key(toggled_key_coordinates[0], toggled_key_coordinates[1])        
-        current_key_index = key.index
-        toggled_key_index = toggled_key.index        
-        
-        if current_key_index > toggled_key_index:
-            current_key_index -= 1
-        if current_key_index < len(toggled_key.commands):
-            self.execute(toggled_key.commands[current_key_index])
+    def run_key_command(self, key, command_index):
+        """ Counts and runs one of the given programmed key's commands by its index """
+        self.store.increment(self.hits_key(key, command_index))
+        self.execute(key.commands[command_index])
+
+    def hits_key(self, key, command_index):
+        """ Returns the store key used to count the uses of a key's command """
+        return 'hits:' + str(key.x) + ',' + str(key.y) + ',' + str(command_index)
+
+    def colour_key(self, key):
+        """ Returns the store key used to persist a colour set on a key at runtime """
+        return 'colour:' + str(key.x) + ',' + str(key.y)
+
+    def command_hits(self, key):
+        """ Returns a list of the number of times each of the key's commands has been run """
+        return [self.store.get(self.hits_key(key, index), 0) for index in range(len(key.commands))]
+
+    def save_state(self, force=False):
+        """ Records the current state in the store and writes any changes to flash, at most once per flush interval and only while no key is pressed """
+        if self.store.path is None or (not force and not self.store.is_due):
+            return False
+        for key in self.keys:
+            if key.is_pressed and not force:
+                return False
+        self.store.set('brightness', self.brightness)
+        self.store.set('colour', list(self.colour.value))
+        if self.toggled_key is None:
+            self.store.set('toggled', None)
+        else:
+            toggled_key = self.get_key(self.toggled_key[0], self.toggled_key[1])
+            self.store.set('toggled', [toggled_key.x, toggled_key.y, toggled_key.brightness])
+        for key in self.keys:
+            colour = key.master_colour.value
+            colour_key = self.colour_key(key)
+            if colour != self._configured_colours[key.index]:
+                self.store.set(colour_key, list(colour))
+            elif self.store.get(colour_key) is not None:
+                # Set back to the colour from the configuration
+                self.store.set(colour_key, None)
+        return self.store.flush(force)
+
+    def restore_state(self):
+        """ Applies the state recorded in the store to the keypad """
+        colour = self.store.get('colour')
+        if colour is not None and colour != list(self.default_colour.value):
+            self.colour = RGB(colour[0], colour[1], colour[2])
+        brightness = self.store.get('brightness')
+        if brightness is not None and brightness != self.brightness:
+            self.brightness = float(brightness)
+        restored = False
+        for key in self.keys:
+            colour = self.store.get(self.colour_key(key))
+            if colour is not None:
+                key.master_colour = RGB(colour[0], colour[1], colour[2])
+                key.colour = key.master_colour
+                restored = True
+        if restored:
+            self.update()
+        toggled = self.store.get('toggled')
+        if toggled is not None:
+            key = self.get_key(toggled[0], toggled[1])
+            if key.is_programmed:
+                self.toggle_on(key, brightness=float(toggled[2]))
 
     def execute(self, command):
-        """ Executes the given command """
-        for command_action in command.actions:
-            
-            if command_action.action_type == 'keyboardShortcut':
-                if len(command_action.action) == 1:
-                    self.enter_keyboard_shortcut(self.keycode_dictionary[command_action.action[0]])    
-                elif len(command_action.action) == 2:
-                    self.enter_keyboard_shortcut(self.keycode_dictionary[command_action.action[0]], self.keycode_dictionary[command_action.action[1]])
-                elif len(command_action.action) == 3:
-                    self.enter_keyboard_shortcut(self.keycode_dictionary[command_action.action[0]], self.keycode_dictionary[command_action.action[1]], self.keycode_dictionary[command_action.action[2]])                
-            
-            elif command_action.action_type == 'enterText':
-               self.enter_text(command_action.action)
+        """ Queues the actions of the given command, which are sent by send_actions() """
+        self._actions.extend(command.actions)
+
+    @property
+    def is_sending(self):
+        """ Whether there are queued actions still to be sent """
+        return len(self._actions) > 0
+
+    @property
+    def is_typing(self):
+        """ Whether the next queued action types text, which a key press interrupts """
+        return len(self._actions) > 0 and self._actions[0].action_type == 'enterText'
+
+    def cancel_actions(self):
+        """ Stops sending the queued actions, including any text part way through being typed """
+        self._actions.clear()
+        self._action_position = 0
+        self._action_next = None
+        if self._text_file is not None:
+            self._text_file.close()
+            self._text_file = None
+        if self._kbd is not None:
+            self._kbd.release_all()
+
+    def send_actions(self):
+        """ Sends the next slice of the queued actions once due, call once per loop """
+        # The delay after an action is cleared once it has passed, even with nothing queued, as ticks_ms() wraps around
+        if self._action_next is not None:
+            if ticks_diff(ticks_ms(), self._action_next) < 0:
+                return
+            self._action_next = None
+        if not self._actions:
+            return
+        command_action = self._actions[0]
+        delay = 0
+
+        if command_action.action_type == 'keyboardShortcut':
+            action = command_action.action
+            if len(action) == 1:
+                self._send_keycodes(self.keycode_dictionary[action[0]])
+            elif len(action) == 2:
+                self._send_keycodes(self.keycode_dictionary[action[0]], self.keycode_dictionary[action[1]])
+            elif len(action) == 3:
+                self._send_keycodes(self.keycode_dictionary[action[0]], self.keycode_dictionary[action[1]], self.keycode_dictionary[action[2]])
+            delay = self.shortcut_delay
+
+        elif command_action.action_type == 'enterText':
+            # Type until the budget is spent, so key presses are still read while long text is typed
+            self._load_keyboard()
+            deadline = ticks_add(ticks_ms(), self.text_budget // 1000)
+            if command_action.file is not None:
+                if not self._type_file(command_action.file, deadline):
+                    return
+            else:
+                text = command_action.action
+                index = self._action_position
+                while index < len(text):
+                    self._write_code_point(ord(text[index]))
+                    index += 1
+                    if ticks_diff(ticks_ms(), deadline) >= 0:
+                        break
+                if index < len(text):
+                    self._action_position = index
+                    return
+            delay = self.text_delay
+
+        self._actions.pop(0)
+        self._action_position = 0
+        self._action_next = ticks_add(ticks_ms(), int(delay * 1000))
 
     def reset(self):
         """ Resets the board, including keys, to default values """
@@ -428,6 +754,7 @@ class PimoroniKeypad:
         self._brightness = self.default_brightness
         self.is_toggled_on = False
         self.toggled_key = None
+        self._page = 0
         for key in self.keys:
             key.colour = key.master_colour
             key.brightness = self.brightness
@@ -440,6 +767,7 @@ class PimoroniKeypad:
         self._brightness = 0.5
         self.is_toggled_on = False
         self.toggled_key = None
+        self._page = 0
         for key in self.keys:
             key.colour = RGB(0, 0, 0)
             key.brightness = 0.0
@@ -456,43 +784,179 @@ class PimoroniKeypad:
         return x * 4 + y
 
     def update(self):
-        """ Takes the colour and brightness value of each key and updates the physical board """
+        """ Takes the colour and brightness value of each key and updates the physical board, or renders the effect while not toggled on """
+        if self._effect is not None and not self.is_toggled_on:
+            self._effect.render(self._frame, ticks_ms())
+            self.show_frame(self._frame)
+            return
+        self._load_pixels()
         for key_index, key in enumerate(self.keys):
             self._pixels[key_index] = (key.pixel_tuple)
+        self._pixels.show()
+
+    def animate(self):
+        """ Renders the next frame of the effect once it is due, call once per loop """
+        if self._effect is None or self.is_toggled_on:
+            # Start afresh when shown again, as ticks_ms() wraps around
+            self._effect_next = None
+            return
+        now = ticks_ms()
+        interval = self._effect.interval
+        if self._effect_next is None:
+            self._effect_next = ticks_add(now, interval)
+            self.update()
+        elif ticks_diff(now, self._effect_next) >= 0:
+            # Keep to the frame rate, unless too far behind to catch up
+            self._effect_next = ticks_add(self._effect_next, interval)
+            if ticks_diff(self._effect_next, now) < 0:
+                self._effect_next = ticks_add(now, interval)
+            self.update()
+
+    def show_frame(self, frame, brightness=None, mask=0xFFFF):
+        """
+        Shows a frame of red, green, and blue values for each key in turn on the physical board, without changing the
+        keys. Only the keys with their bit set in mask (bit 0 is key 0) are shown from the frame, the others show their
+        own colour and brightness
+        """
+        self._load_pixels()
+        if brightness is None:
+            brightness = self.brightness
+
+        # Each pixel is set from a single integer, 0xRRGGBB with the brightness applied, rather than a new tuple
+        pixels = self._pixels
+        keys = self._keys
+        frame_level = int(brightness * 256)
+        for key_index in range(self._num_pixels):
+            if mask & (1 << key_index):
+                offset = key_index * 3
+                level = frame_level
+                red = frame[offset]
+                green = frame[offset + 1]
+                blue = frame[offset + 2]
+            else:
+                key = keys[key_index]
+                colour = key.colour
+                level = int(key.brightness * 256)
+                red = colour.red
+                green = colour.green
+                blue = colour.blue
+            pixels[key_index] = (red * level >> 8) << 16 | (green * level >> 8) << 8 | blue * level >> 8
+        pixels.show()
 
     def enter_keyboard_shortcut(self, input_one, input_two=None, input_three=None):
         """ Takes in input keycodes, and sends the commands """
-        if input_two is not None and input_three is not None:
-            self._kbd.send(input_one, input_two, input_three)            
-        elif input_two is not None and input_three is None:
-            self._kbd.send(input_one, input_two)            
-        else:
-            self._kbd.send(input_one)            
-        time.sleep(1)
+        self._send_keycodes(input_one, input_two, input_three)
+        time.sleep(self.shortcut_delay)
 
     def enter_text(self, input):
         """ Takes in text, and types it via the keyboard """
+        self._load_keyboard()
         self._layout.write(input)
-        time.sleep(0.5)
+        time.sleep(self.text_delay)
+
+    def _type_file(self, path, deadline):
+        """ Types the text from the given file until the deadline, in ticks from ticks_ms(), returning whether the end of the file was reached """
+        if self._text_file is None:
+            from .KeypadTextFile import KeypadTextFile
+            self._text_file = KeypadTextFile(self._resolve_path(path), self.text_buffer_size)
+        finished = True
+        try:
+            while True:
+                code_point = self._text_file.read()
+                if code_point < 0:
+                    break
+                self._write_code_point(code_point)
+                if ticks_diff(ticks_ms(), deadline) >= 0:
+                    finished = False
+                    break
+        except (OSError, ValueError) as error:
+            # Stop typing the file if it can't be read or isn't valid UTF-8, rather than stopping the main loop
+            print('Unable to read', path, error)
+        finally:
+            if finished:
+                self._text_file.close()
+                self._text_file = None
+        return finished
+
+    def _write_code_point(self, code_point):
+        """ Types the character with the given code point, skipping characters the keyboard layout can't type """
+        try:
+            self._layout.write_code_point(code_point)
+        except ValueError as error:
+            print(error)
+
+    def _resolve_path(self, path):
+        """ Returns the path of a file named in the configuration, relative to the folder of the configuration file """
+        folder_end = self.config_file.rfind('/')
+        if path.startswith('/') or folder_end < 0:
+            return path
+        return self.config_file[:folder_end + 1] + path
+
+    def _send_keycodes(self, input_one, input_two=None, input_three=None):
+        """ Presses and releases up to three keycodes together """
+        self._load_keyboard()
+        if input_two is not None and input_three is not None:
+            self._kbd.send(input_one, input_two, input_three)
+        elif input_two is not None and input_three is None:
+            self._kbd.send(input_one, input_two)
+        else:
+            self._kbd.send(input_one)
 
-    def load(self):
-        """ Set up load animation from configuration """
+    def load(self, background=False):
+        """ Set up load animation from configuration, in the background the animation is stepped by load_pressed_keys() """
         load_pattern = self.config['loadPattern']
         load_delay = self.config['loadPatternDelay']        
         if isinstance(load_pattern, str):
-            self._pattern_load(self.default_colour, self.load_patterns[load_pattern], load_delay)
+            load_pattern = self.load_patterns[load_pattern]
+        if background:
+            self._loader = self._pattern_steps(self.default_colour, load_pattern, load_delay)
+            self._load_next = None
         else:
             self._pattern_load(self.default_colour, load_pattern, load_delay)
 
     def _pattern_load(self, colour, pattern, load_delay):
         """ Execute load pattern from given values """
+        for delay in self._pattern_steps(colour, pattern, load_delay):
+            time.sleep(delay)
+
+    def _pattern_steps(self, colour, pattern, load_delay):
+        """ Generates each step of the load pattern, yielding the delay before the next step """
         self.colour = RGB(0, 0, 0)
         self.default_colour = colour
         for key_index in pattern:
             self.keys[key_index].fade_to_colour(colour)
-            time.sleep(load_delay)
+            yield load_delay
         self.reset()
 
+    def _step_load(self, skip):
+        """ Runs the next step of the background load animation once it is due, or finishes it straight away when skipped """
+        if skip:
+            self._loader = None
+            self.reset()
+            self.restore_state()
+        elif self._load_next is None or ticks_diff(ticks_ms(), self._load_next) >= 0:
+            try:
+                self._load_next = ticks_add(ticks_ms(), int(next(self._loader) * 1000))
+            except StopIteration:
+                self._loader = None
+                self.restore_state()
+
+    def _load_pixels(self):
+        """ Set up the APA102 pixels, if they have not already been set up """
+        if self._pixels is None:
+            import adafruit_dotstar
+            self._pixels = adafruit_dotstar.DotStar(board.GP18, board.GP19, self._num_pixels, brightness=self.default_brightness, auto_write=False)
+
+    def _load_keyboard(self):
+        """ Set up the keyboard and its layout, if they have not already been set up """
+        if self._kbd is None:
+            import usb_hid
+            from adafruit_hid.keyboard import Keyboard
+            keyboard = Keyboard(usb_hid.devices)
+            layout = KeypadLayout(keyboard, self.config.get('keyboardLayout', 'us'))
+            self._kbd = keyboard
+            self._layout = layout
+
 
 """
 KeypadKey
@@ -517,7 +981,9 @@ class KeypadKey():
         - still_pressed
         - is_programmed
         - commands
+        - pages
         """
+        self._pages = None
         self.x = x
         self.y = y
         self.keypad = keypad
@@ -616,6 +1082,7 @@ class KeypadKey():
             self._master_colour = value
         else:
             raise TypeError('colour must be an RGB object or None type')
+        self._pages = None
 
     @master_colour.deleter
     def master_colour(self):
@@ -706,13 +1173,23 @@ class KeypadKey():
 
     @property
     def commands(self):
-        """ The programmed commands linked to the key """
+        """ The programmed commands linked to the key, built from the configuration on first use """
+        if self._command_config is not None:
+            command_config = self._command_config
+            self._command_config = None
+            for command_object in command_config:
+                command = KeypadCommand()                 
+                for action_object in command_object:
+                    command.actions.append(KeypadAction(action_object['actionType'], action_object.get('action', ''), action_object.get('file')))                    
+                self._commands.append(command)
         return self._commands
     
     @commands.setter
     def commands(self, value):
         if isinstance(value, list):
             self._commands = value
+            self._command_config = None
+            self._pages = None
         else:
             raise TypeError('commands must be an list array')
     
@@ -720,6 +1197,13 @@ class KeypadKey():
     def commands(self):
         raise AttributeError('Do not delete commands')
 
+    @property
+    def pages(self):
+        """ The pages of the key's commands shown when toggled on, precomputed on first use """
+        if self._pages is None:
+            self._pages = self._build_pages()
+        return self._pages
+
     @property
     def pixel_tuple(self):
         """ The colour and brightness values used to update the key on the keypad, represented as a tuple (red, green, blue, brightness) """
@@ -735,6 +1219,14 @@ class KeypadKey():
         """ The index of the key between 0-15, derived from the key's coordinates """
         return self.x * 4 + self.y
      
+    def load_commands(self, command_config):
+        """ Stores the commands from the configuration, to be built into KeypadCommand objects when first used """
+        if isinstance(command_config, list):
+            self._command_config = command_config
+            self._pages = None
+        else:
+            raise TypeError('command_config must be a list array')
+
     def reset(self):
         """ Reset the key back to it's default values and updates the keypad """
         self.colour = self.keypad.default_colour
@@ -752,6 +1244,35 @@ class KeypadKey():
             self.colour = RGB(r,g,b)
             self.keypad.update()
 
+    def _build_pages(self):
+        """
+        Maps the commands onto the other 15 keys, starting top left and moving left to right, top to bottom. When
+        there are more than 15 commands, the last two of the keys move to the previous and next page instead
+        """
+        slots = [index for index in range(16) if index != self.index]
+        number_of_commands = len(self.commands)
+        is_paged = number_of_commands > len(slots)
+        commands_per_page = len(slots) - 2 if is_paged else len(slots)
+        number_of_pages = max(1, (number_of_commands + commands_per_page - 1) // commands_per_page)
+
+        pages = []
+        for page_index in range(number_of_pages):
+            page = KeypadPage()
+            page.colours[self.index] = self.master_colour
+            first_command = page_index * commands_per_page
+            for slot_index in range(commands_per_page):
+                command_index = first_command + slot_index
+                if command_index < number_of_commands:
+                    page.dispatch[slots[slot_index]] = command_index
+                    page.colours[slots[slot_index]] = self.master_colour
+            if is_paged:
+                page.dispatch[slots[-2]] = KeypadPage.PREVIOUS
+                page.colours[slots[-2]] = self.keypad.page_colour
+                page.dispatch[slots[-1]] = KeypadPage.NEXT
+                page.colours[slots[-1]] = self.keypad.page_colour
+            pages.append(page)
+        return pages
+
     def _map(self, value, in_min, in_max, out_min, out_max):
         """ Maps the given value between two sets of values and scales the result """
         return int((value-in_min) * (out_max-out_min) / (in_max-in_min) + out_min)
@@ -790,6 +1311,67 @@ class KeypadCommand():
         raise AttributeError('Do not delete actions')
 
 
+"""
+KeypadPage
+================================================================================
+A class representing a page of the commands assigned to a Pimoroni keypad key,
+precomputed so moving between pages only swaps which page is shown
+"""
+
+class KeypadPage():
+    """ A page of the commands linked to a Pimoroni keypad key """
+
+    EMPTY = -1
+    """ The dispatch value of a key without a command """
+
+    NEXT = -2
+    """ The dispatch value of the key that moves to the next page """
+
+    PREVIOUS = -3
+    """ The dispatch value of the key that moves to the previous page """
+
+    def __init__(self):
+        """
+        A page of the commands linked to a Pimoroni keypad key. Initialization sets the following properties:
+        - dispatch
+        - colours
+        """
+        self.dispatch = [self.EMPTY] * 16
+        self.colours = [None] * 16
+
+    @property
+    def dispatch(self):
+        """ The index of the command run by each key, or EMPTY, NEXT or PREVIOUS """
+        return self._dispatch
+
+    @dispatch.setter
+    def dispatch(self, value):
+        if isinstance(value, list):
+            self._dispatch = value
+        else:
+            raise TypeError('dispatch must be a list array')
+
+    @dispatch.deleter
+    def dispatch(self):
+        raise AttributeError('Do not delete dispatch')
+
+    @property
+    def colours(self):
+        """ The colour of each key while the page is shown, None for the default colour of the keypad """
+        return self._colours
+
+    @colours.setter
+    def colours(self, value):
+        if isinstance(value, list):
+            self._colours = value
+        else:
+            raise TypeError('colours must be a list array')
+
+    @colours.deleter
+    def colours(self):
+        raise AttributeError('Do not delete colours')
+
+
 """
 KeypadAction
 ================================================================================
@@ -800,13 +1382,15 @@ Pimoroni keypad key
 class KeypadAction():
     """ An action that makes up the command linked with a Pimoroni keypad key """
     
-    def __init__(self, action_type, action):
+    def __init__(self, action_type, action, file=None):
         """ An action that makes up the command linked with a Pimoroni keypad key. Initialization sets the following properties:
         - action_type
         - action
+        - file
         """
         self.action_type = action_type
         self.action = action
+        self.file = file
 
     @property
     def action_type(self):
@@ -840,6 +1424,22 @@ class KeypadAction():
     def action(self):
         raise AttributeError('Do not delete action')
 
+    @property
+    def file(self):
+        """ The file on the CIRCUITPY drive an enterText action types the text of, in place of the action, or None """
+        return self._file
+
+    @file.setter
+    def file(self, value):
+        if value is None or isinstance(value, str):
+            self._file = value
+        else:
+            raise TypeError('file must be a string or None type')
+
+    @file.deleter
+    def file(self):
+        raise AttributeError('Do not delete file')
+
 
 """
 RGB
@@ -1 +1,5 @@
-from .PimoroniKeypad import PimoroniKeypad, KeypadKey, KeypadCommand, KeypadAction, RGB
\ No newline at end of file
+from .PimoroniKeypad import PimoroniKeypad, KeypadKey, KeypadCommand, KeypadPage, KeypadAction, RGB
+from .KeypadLayout import KeypadLayout
+from .KeypadStore import KeypadStore
+from .KeypadSerial import KeypadSerial
+from .KeypadScheduler import KeypadScheduler, KeypadTask
@@ -0,0 +1,6 @@
+"""
+layouts
+================================================================================
+Precomputed keyboard layout tables, generated by tools/build_layouts.py. Each
+layout is a separate module so only the configured layout is ever imported.
+"""
@@ -0,0 +1,43 @@
+"""
+de
+================================================================================
+Keyboard layout tables generated by tools/build_layouts.py, do not edit
+
+ASCII holds a (modifier, keycode) pair of bytes for each character below 128,
+HIGHER maps any other supported character to modifier << 8 | keycode
+"""
+
+ASCII = (
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x2a\x00\x2b\x00\x28\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x29\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x2c\xe1\x1e\xe1\x1f\x00\x32\xe1\x21\xe1\x22\xe1\x23\xe1\x32'
+    b'\xe1\x25\xe1\x26\xe1\x30\x00\x30\x00\x36\x00\x38\x00\x37\xe1\x24'
+    b'\x00\x27\x00\x1e\x00\x1f\x00\x20\x00\x21\x00\x22\x00\x23\x00\x24'
+    b'\x00\x25\x00\x26\xe1\x37\xe1\x36\x00\x64\xe1\x27\xe1\x64\xe1\x2d'
+    b'\xe6\x14\xe1\x04\xe1\x05\xe1\x06\xe1\x07\xe1\x08\xe1\x09\xe1\x0a'
+    b'\xe1\x0b\xe1\x0c\xe1\x0d\xe1\x0e\xe1\x0f\xe1\x10\xe1\x11\xe1\x12'
+    b'\xe1\x13\xe1\x14\xe1\x15\xe1\x16\xe1\x17\xe1\x18\xe1\x19\xe1\x1a'
+    b'\xe1\x1b\xe1\x1d\xe1\x1c\xe6\x25\xe6\x2d\xe6\x26\x00\x00\xe1\x38'
+    b'\x00\x00\x00\x04\x00\x05\x00\x06\x00\x07\x00\x08\x00\x09\x00\x0a'
+    b'\x00\x0b\x00\x0c\x00\x0d\x00\x0e\x00\x0f\x00\x10\x00\x11\x00\x12'
+    b'\x00\x13\x00\x14\x00\x15\x00\x16\x00\x17\x00\x18\x00\x19\x00\x1a'
+    b'\x00\x1b\x00\x1d\x00\x1c\xe6\x24\xe6\x64\xe6\x27\xe6\x30\x00\x4c'
+)
+
+HIGHER = {
+    0x00a7: 0xe120,
+    0x00b0: 0xe135,
+    0x00b2: 0xe61f,
+    0x00b3: 0xe620,
+    0x00b5: 0xe610,
+    0x00c4: 0xe134,
+    0x00d6: 0xe133,
+    0x00dc: 0xe12f,
+    0x00df: 0x002d,
+    0x00e4: 0x0034,
+    0x00f6: 0x0033,
+    0x00fc: 0x002f,
+    0x20ac: 0xe608,
+}
@@ -0,0 +1,34 @@
+"""
+uk
+================================================================================
+Keyboard layout tables generated by tools/build_layouts.py, do not edit
+
+ASCII holds a (modifier, keycode) pair of bytes for each character below 128,
+HIGHER maps any other supported character to modifier << 8 | keycode
+"""
+
+ASCII = (
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x2a\x00\x2b\x00\x28\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x29\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x2c\xe1\x1e\xe1\x1f\x00\x32\xe1\x21\xe1\x22\xe1\x24\x00\x34'
+    b'\xe1\x26\xe1\x27\xe1\x25\xe1\x2e\x00\x36\x00\x2d\x00\x37\x00\x38'
+    b'\x00\x27\x00\x1e\x00\x1f\x00\x20\x00\x21\x00\x22\x00\x23\x00\x24'
+    b'\x00\x25\x00\x26\xe1\x33\x00\x33\xe1\x36\x00\x2e\xe1\x37\xe1\x38'
+    b'\xe1\x34\xe1\x04\xe1\x05\xe1\x06\xe1\x07\xe1\x08\xe1\x09\xe1\x0a'
+    b'\xe1\x0b\xe1\x0c\xe1\x0d\xe1\x0e\xe1\x0f\xe1\x10\xe1\x11\xe1\x12'
+    b'\xe1\x13\xe1\x14\xe1\x15\xe1\x16\xe1\x17\xe1\x18\xe1\x19\xe1\x1a'
+    b'\xe1\x1b\xe1\x1c\xe1\x1d\x00\x2f\x00\x64\x00\x30\xe1\x23\xe1\x2d'
+    b'\x00\x35\x00\x04\x00\x05\x00\x06\x00\x07\x00\x08\x00\x09\x00\x0a'
+    b'\x00\x0b\x00\x0c\x00\x0d\x00\x0e\x00\x0f\x00\x10\x00\x11\x00\x12'
+    b'\x00\x13\x00\x14\x00\x15\x00\x16\x00\x17\x00\x18\x00\x19\x00\x1a'
+    b'\x00\x1b\x00\x1c\x00\x1d\xe1\x2f\xe1\x64\xe1\x30\xe1\x32\x00\x4c'
+)
+
+HIGHER = {
+    0x00a3: 0xe120,
+    0x00a6: 0xe635,
+    0x00ac: 0xe135,
+    0x20ac: 0xe621,
+}
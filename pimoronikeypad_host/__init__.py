@@ -0,0 +1,7 @@
+"""
+pimoronikeypad_host
+================================================================================
+Host side tools for the Pimoroni keypad, run on a computer rather than on the
+device: a companion daemon exposing the keypad to local programs, and a
+loopback keypad that runs the device code against simulated hardware
+"""
@@ -0,0 +1,42 @@
+import asyncio
+import argparse
+
+from .daemon import DEFAULT_SOCKET, KeypadDaemon, SerialTransport
+
+
+"""
+__main__
+================================================================================
+Runs the companion daemon:
+
+    python -m pimoronikeypad_host --port /dev/ttyACM1
+    python -m pimoronikeypad_host --loopback config.json
+"""
+
+def main():
+    """ Parses the command line and runs the daemon until interrupted """
+    parser = argparse.ArgumentParser(prog='python -m pimoronikeypad_host', description='Companion daemon for the Pimoroni keypad')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', help='the usb_cdc data serial port of the keypad, e.g. /dev/ttyACM1 or COM4')
+    source.add_argument('--loopback', metavar='CONFIG', help='run a simulated keypad using the given config.json')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='the path of the Unix socket to listen on (default: %(default)s)')
+    parser.add_argument('--frame-rate', type=float, default=60, help='the maximum number of frames sent to the keypad each second (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    if arguments.loopback:
+        from .loopback import LoopbackKeypad
+        transport = LoopbackKeypad(arguments.loopback)
+        transport.start()
+    else:
+        transport = SerialTransport(arguments.port)
+
+    daemon = KeypadDaemon(transport, arguments.socket, frame_rate=arguments.frame_rate)
+    print('Listening on', arguments.socket)
+    try:
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
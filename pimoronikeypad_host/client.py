@@ -0,0 +1,143 @@
+import json
+import asyncio
+import itertools
+
+from .daemon import DEFAULT_SOCKET, KeypadError
+
+
+"""
+client
+================================================================================
+A client for the companion daemon, keeping a single connection open for any
+number of requests, batches and key events
+"""
+
+class KeypadClient():
+    """ A connection to the companion daemon """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        """
+        A connection to the companion daemon. Initialization sets the following property:
+        - socket_path
+
+        The connection is opened by connect(), or by using the client with async with
+        """
+        self.socket_path = socket_path
+        self._reader = None
+        self._writer = None
+        self._listener = None
+        self._ids = itertools.count(1)
+        self._waiting = {}
+        self._batches = []
+        self._events = asyncio.Queue()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        """ Opens the connection to the daemon """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def close(self):
+        """ Closes the connection to the daemon """
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._listener.cancel()
+            self._writer = None
+
+    async def request(self, op, **fields):
+        """ Sends a single request and returns the response, raising a KeypadError if it failed """
+        request = dict(fields, op=op, id=next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request['id']] = future
+        await self._send(request)
+        return _check(await future)
+
+    async def batch(self, requests):
+        """ Sends a list of requests, as (op, fields) pairs, in a single write and returns the list of responses """
+        future = asyncio.get_running_loop().create_future()
+        self._batches.append(future)
+        await self._send([dict(fields, op=op) for op, fields in requests])
+        return [_check(response) for response in await future]
+
+    async def events(self):
+        """ Subscribes to key events, and yields each event as it arrives """
+        await self.request('subscribe')
+        while True:
+            yield await self._events.get()
+
+    # Shortcuts for each of the daemon's requests
+
+    async def ping(self):
+        """ Returns the protocol version of the keypad """
+        return (await self.request('ping'))['version']
+
+    async def set_colour(self, x, y, colour):
+        """ Sets the colour of a single key """
+        await self.request('set_colour', x=x, y=y, colour=list(colour))
+
+    async def set_frame(self, colours, brightness=None):
+        """ Sets the colour of every key """
+        fields = {'colours': [list(colour) for colour in colours]}
+        if brightness is not None:
+            fields['brightness'] = brightness
+        await self.request('set_frame', **fields)
+
+    async def run(self, x, y, index):
+        """ Runs a command of a programmed key """
+        await self.request('run', x=x, y=y, index=index)
+
+    async def layer(self, x, y, brightness=None):
+        """ Toggles on a programmed key """
+        fields = {'x': x, 'y': y}
+        if brightness is not None:
+            fields['brightness'] = brightness
+        await self.request('layer', **fields)
+
+    async def reset(self):
+        """ Resets the keypad """
+        await self.request('layer', reset=True)
+
+    async def counters(self, x, y):
+        """ Returns how many times each command of a programmed key has been run """
+        return (await self.request('counters', x=x, y=y))['counts']
+
+    async def _send(self, message):
+        """ Writes a message to the daemon """
+        await self.connect()
+        self._writer.write(json.dumps(message).encode() + b'\n')
+        await self._writer.drain()
+
+    async def _listen(self):
+        """ Routes each line from the daemon to the request, batch, or event it belongs to """
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if isinstance(message, list):
+                if self._batches:
+                    self._batches.pop(0).set_result(message)
+            elif 'event' in message:
+                self._events.put_nowait(message)
+            elif message.get('id') in self._waiting:
+                self._waiting.pop(message['id']).set_result(message)
+        for future in list(self._waiting.values()) + self._batches:
+            if not future.done():
+                future.set_exception(KeypadError('the daemon closed the connection'))
+        self._waiting.clear()
+        self._batches.clear()
+
+
+def _check(response):
+    """ Returns the response, raising a KeypadError if the request failed """
+    if not response.get('ok'):
+        raise KeypadError(response.get('error', 'request failed'))
+    return response
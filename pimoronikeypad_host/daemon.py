@@ -0,0 +1,376 @@
+import os
+import json
+import asyncio
+import tempfile
+import threading
+import collections
+
+from . import protocol
+
+
+"""
+daemon
+================================================================================
+A companion daemon that owns the connection to the keypad and shares it with
+any number of local programs through a Unix socket.
+
+Clients send one JSON request per line, or a JSON array of requests to send a
+batch, and receive a JSON response per request (an array for a batch). Colour
+changes from every client are merged into a single frame, sent to the keypad
+at most once per frame interval, and keys no client has set keep their own
+colours. Requests to the keypad from a batch are sent back to back without
+waiting for each reply
+"""
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir()), 'pimoronikeypad.sock')
+""" The path of the socket used when none is given """
+
+
+class KeypadError(Exception):
+    """ Raised when the keypad can not carry out a request """
+
+
+class SerialTransport():
+    """ The connection to a keypad over its usb_cdc data serial port, requires pyserial """
+
+    def __init__(self, port, baudrate=115200):
+        """ The connection to a keypad over its usb_cdc data serial port, requires pyserial """
+        import serial
+        self._serial = serial.Serial(port, baudrate, timeout=0.1)
+
+    def read(self, timeout=0.1):
+        """ Reads the bytes sent by the keypad, waiting up to the timeout """
+        self._serial.timeout = timeout
+        return self._serial.read(max(1, self._serial.in_waiting))
+
+    def write(self, data):
+        """ Sends bytes to the keypad """
+        self._serial.write(data)
+
+    def close(self):
+        """ Closes the serial port """
+        self._serial.close()
+
+
+class KeypadDaemon():
+    """ Shares a keypad connection with local programs through a Unix socket """
+
+    max_client_buffer = 1 << 20
+    """ The number of unsent bytes a client can fall behind by before it is disconnected """
+
+    subscribe_interval = 5.0
+    """ The number of seconds between renewing the subscription to key events, which the keypad forgets when it restarts """
+
+    def __init__(self, transport, socket_path=DEFAULT_SOCKET, frame_rate=60, reply_timeout=2.0):
+        """
+        Shares a keypad connection with local programs through a Unix socket. Initialization sets the following properties:
+        - transport, a SerialTransport or LoopbackKeypad
+        - socket_path
+        - frame_rate, the maximum number of frames sent to the keypad each second
+        - reply_timeout, the number of seconds to wait for the keypad to reply
+        """
+        self.transport = transport
+        self.socket_path = socket_path
+        self.frame_rate = frame_rate
+        self.reply_timeout = reply_timeout
+        self.colours = [None] * 16
+        self.brightness = None
+        self._frame_dirty = False
+        self._decoder = protocol.Decoder()
+        self._pending = collections.deque()
+        self._resync = False
+        self._subscribers = set()
+        self._loop = None
+        self._server = None
+        self._frames = None
+        self._subscription = None
+        self._running = False
+        self._reader = None
+
+    async def start(self):
+        """ Starts listening on the socket and reading from the keypad """
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+        self._reader = threading.Thread(target=self._read_transport, name='KeypadDaemonReader', daemon=True)
+        self._reader.start()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        self._frames = asyncio.ensure_future(self._send_frames())
+        await self._request(protocol.SUBSCRIBE, [1])
+        self._subscription = asyncio.ensure_future(self._keep_subscribed())
+
+    async def serve_forever(self):
+        """ Starts the daemon and runs until cancelled """
+        try:
+            await self.start()
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """ Stops listening, turns off key events and closes the connection to the keypad """
+        for task in (self._frames, self._subscription):
+            if task is not None:
+                task.cancel()
+        self._frames = None
+        self._subscription = None
+        if self._reader is not None:
+            # Otherwise the keypad carries on writing key events to a port nobody reads
+            try:
+                await self._request(protocol.SUBSCRIBE, [0])
+            except KeypadError:
+                pass
+        self._running = False
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for client in list(self._subscribers):
+            client.close()
+        if self._reader is not None:
+            await self._loop.run_in_executor(None, self._reader.join)
+            self._reader = None
+        self.transport.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    # Keypad connection
+
+    def _read_transport(self):
+        """ Reads from the keypad on a background thread, handing the data to the event loop """
+        while self._running:
+            data = self.transport.read(0.1)
+            if data:
+                self._loop.call_soon_threadsafe(self._on_data, data)
+
+    def _on_data(self, data):
+        """ Handles the packets sent by the keypad """
+        for command, payload in self._decoder.feed(data):
+            if command == protocol.KEY_EVENT:
+                self._broadcast({
+                    'event': 'key',
+                    'index': payload[0],
+                    'x': payload[0] // 4,
+                    'y': payload[0] % 4,
+                    'pressed': bool(payload[1])
+                })
+            elif command == protocol.ERROR:
+                future = self._pop_pending(payload[0])
+                if future is not None:
+                    future.set_exception(KeypadError(protocol.STATUSES.get(payload[1], 'unknown error')))
+            elif command & protocol.REPLY:
+                future = self._pop_pending(command & ~protocol.REPLY)
+                if future is not None:
+                    future.set_result(payload)
+
+    def _pop_pending(self, command):
+        """
+        Returns the request a reply to the command belongs to, or None if that request has timed out. The keypad
+        replies in the order requests are sent, so the reply belongs to the oldest request for the command, and any
+        older request for another command lost its reply
+        """
+        if not any(pending_command == command for pending_command, future in self._pending):
+            return None
+        while True:
+            pending_command, future = self._pending.popleft()
+            if pending_command == command:
+                return future if future is not None and not future.done() else None
+            if future is not None and not future.done():
+                future.set_exception(KeypadError('the keypad did not reply'))
+
+    async def _request(self, command, payload=b''):
+        """ Sends a packet to the keypad and waits for the reply """
+        if self._resync:
+            # After a timeout, a ping that nothing waits for makes sure a late or lost reply can't be matched to a
+            # later request for the same command
+            self._resync = False
+            self._pending.append((protocol.PING, None))
+            self.transport.write(protocol.encode(protocol.PING))
+        future = self._loop.create_future()
+        self._pending.append((command, future))
+        self.transport.write(protocol.encode(command, payload))
+        try:
+            return await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self._resync = True
+            raise KeypadError('the keypad did not reply')
+
+    async def _keep_subscribed(self):
+        """ Renews the subscription to key events, so they carry on after the keypad restarts """
+        while True:
+            await asyncio.sleep(self.subscribe_interval)
+            try:
+                await self._request(protocol.SUBSCRIBE, [1])
+            except KeypadError:
+                pass
+
+    async def _send_frames(self):
+        """ Sends the merged colours to the keypad whenever they have changed, at most frame_rate times a second """
+        while True:
+            if self._frame_dirty:
+                self._frame_dirty = False
+                if None in self.colours:
+                    self.transport.write(protocol.encode_keys(self.colours, self.brightness))
+                else:
+                    self.transport.write(protocol.encode_frame(self.colours, self.brightness))
+            await asyncio.sleep(1 / self.frame_rate)
+
+    # Clients
+
+    async def _handle_client(self, reader, writer):
+        """ Handles the requests of a connected client until it disconnects """
+        client = _Client(writer, self.max_client_buffer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    client.send({'ok': False, 'error': 'request is not valid JSON'})
+                    continue
+                if isinstance(request, list):
+                    client.send(list(await asyncio.gather(*[self._handle_request(client, item) for item in request])))
+                else:
+                    client.send(await self._handle_request(client, request))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(client)
+            client.close()
+
+    def _broadcast(self, message):
+        """ Sends a message to every subscribed client """
+        for client in list(self._subscribers):
+            if not client.send(message):
+                self._subscribers.discard(client)
+
+    async def _handle_request(self, client, request):
+        """ Carries out a single request, and returns the response """
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'request must be an object'}
+        response = {'ok': True}
+        if 'id' in request:
+            response['id'] = request['id']
+        handler = getattr(self, '_op_' + str(request.get('op')), None)
+        if handler is None:
+            response.update(ok=False, error='unknown op ' + repr(request.get('op')))
+            return response
+        try:
+            result = await handler(client, request)
+        except (KeypadError, KeyError, TypeError, ValueError, IndexError) as error:
+            response.update(ok=False, error=str(error) or type(error).__name__)
+            return response
+        if result:
+            response.update(result)
+        return response
+
+    async def _op_ping(self, client, request):
+        """ Checks the keypad is connected """
+        payload = await self._request(protocol.PING)
+        return {'version': payload[0]}
+
+    async def _op_set_colour(self, client, request):
+        """ Sets the colour of a single key, {"x": 0, "y": 0, "colour": [255, 0, 0]} """
+        index = _key_index(request)
+        self.colours[index] = _colour(request['colour'])
+        self._frame_dirty = True
+
+    async def _op_set_frame(self, client, request):
+        """ Sets the colour of every key, {"colours": [[255, 0, 0], ...], "brightness": 0.5} """
+        colours = request['colours']
+        if len(colours) != 16:
+            raise ValueError('colours must have a value for each of the 16 keys')
+        self.colours = [_colour(colour) for colour in colours]
+        if 'brightness' in request:
+            self.brightness = float(request['brightness'])
+        self._frame_dirty = True
+
+    async def _op_run(self, client, request):
+        """ Runs a command of a programmed key, {"x": 0, "y": 0, "index": 2} """
+        index = _key_index(request)
+        await self._request(protocol.RUN, [index // 4, index % 4, int(request['index'])])
+
+    async def _op_layer(self, client, request):
+        """ Toggles on a programmed key, {"x": 0, "y": 0, "brightness": 1.0}, or resets the keypad, {"reset": true} """
+        self._frame_dirty = False
+        if request.get('reset'):
+            await self._request(protocol.LAYER, [0xFF])
+            return
+        index = _key_index(request)
+        payload = [index // 4, index % 4]
+        if 'brightness' in request:
+            payload.append(protocol.clamp(round(float(request['brightness']) * 255)))
+        await self._request(protocol.LAYER, payload)
+
+    async def _op_counters(self, client, request):
+        """ Reads how many times each command of a programmed key has been run, {"x": 0, "y": 0} """
+        index = _key_index(request)
+        payload = await self._request(protocol.COUNTERS, [index // 4, index % 4])
+        counts = [payload[offset] << 8 | payload[offset + 1] for offset in range(2, len(payload), 2)]
+        return {'counts': counts}
+
+    async def _op_profile(self, client, request):
+        """ Prints the profiling report to the keypad's console, when profiling is enabled in its configuration """
+        await self._request(protocol.PROFILE)
+
+    async def _op_subscribe(self, client, request):
+        """ Sends the client an event each time a key is pressed or released """
+        self._subscribers.add(client)
+
+    async def _op_unsubscribe(self, client, request):
+        """ Stops sending the client key events """
+        self._subscribers.discard(client)
+
+    async def _op_press(self, client, request):
+        """ Presses or releases a key of the loopback keypad, {"x": 0, "y": 0, "pressed": true} """
+        if not hasattr(self.transport, 'press'):
+            raise KeypadError('keys can only be pressed on the loopback keypad')
+        index = _key_index(request)
+        if request.get('pressed', True):
+            self.transport.press(index // 4, index % 4)
+        else:
+            self.transport.release(index // 4, index % 4)
+
+
+class _Client():
+    """ A connected client """
+
+    def __init__(self, writer, max_buffer):
+        """ A connected client """
+        self._writer = writer
+        self._max_buffer = max_buffer
+
+    def send(self, message):
+        """ Queues a message to the client, returns False if the client has disconnected or fallen too far behind """
+        if self._writer.is_closing():
+            return False
+        if self._writer.transport.get_write_buffer_size() > self._max_buffer:
+            self.close()
+            return False
+        self._writer.write(json.dumps(message).encode() + b'\n')
+        return True
+
+    def close(self):
+        """ Disconnects the client """
+        if not self._writer.is_closing():
+            self._writer.close()
+
+
+def _key_index(request):
+    """ Returns the index of the key at the x, y coordinates of the request """
+    x = int(request['x'])
+    y = int(request['y'])
+    if not (0 <= x <= 3 and 0 <= y <= 3):
+        raise ValueError('x and y must be between 0 and 3 inclusive')
+    return x * 4 + y
+
+
+def _colour(value):
+    """ Returns a colour as a list of red, green, and blue values between 0 and 255 """
+    if len(value) != 3:
+        raise ValueError('colour must be a list of red, green, and blue values')
+    return [protocol.clamp(channel) for channel in value]
@@ -0,0 +1,287 @@
+import sys
+import types
+import threading
+
+
+"""
+hardware
+================================================================================
+Simulated stand-ins for the CircuitPython modules used by the pimoronikeypad
+library, so the device code can be run on a computer. The adafruit_hid library
+is not simulated, the real library is installed from pypi and sends its
+reports to a simulated USB HID device.
+
+Call install() before importing pimoronikeypad
+"""
+
+class Pin():
+    """ A simulated microcontroller pin """
+
+    def __init__(self, name):
+        """ A simulated microcontroller pin """
+        self.name = name
+
+    def __repr__(self):
+        return 'board.' + self.name
+
+
+class Direction():
+    """ The direction of a digital pin """
+    INPUT = 0
+    OUTPUT = 1
+
+
+class DigitalInOut():
+    """ A simulated digital pin """
+
+    def __init__(self, pin):
+        """ A simulated digital pin """
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.value = 0
+
+
+class I2C():
+    """ A simulated I2C bus, with the TCA9555 IO expander of the keypad attached """
+
+    def __init__(self, scl, sda):
+        """
+        A simulated I2C bus, with the TCA9555 IO expander of the keypad attached. Initialization sets the following properties:
+        - pressed
+        - reads
+        """
+        self.scl = scl
+        self.sda = sda
+        self.pressed = 0
+        self.reads = 0
+        self.on_read = None
+
+    def press(self, index):
+        """ Presses down the key with the given index """
+        self.pressed |= 1 << index
+
+    def release(self, index):
+        """ Releases the key with the given index """
+        self.pressed &= ~(1 << index)
+
+    def read_inputs(self):
+        """ Returns the input register of the IO expander, where a pressed key reads as a 0 bit """
+        if self.on_read is not None:
+            self.on_read(self)
+        self.reads += 1
+        return ~self.pressed & 0xFFFF
+
+
+class I2CDevice():
+    """ A simulated adafruit_bus_device I2C device """
+
+    def __init__(self, i2c, device_address):
+        """ A simulated adafruit_bus_device I2C device """
+        self.i2c = i2c
+        self.device_address = device_address
+        self._register = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def write(self, buffer, start=0, end=None):
+        """ Selects the register to read from """
+        self._register = buffer[start]
+
+    def readinto(self, buffer, start=0, end=None):
+        """ Reads the input registers of the IO expander into the buffer """
+        value = self.i2c.read_inputs() if self._register == 0 else 0
+        buffer[start] = value & 0xFF
+        buffer[start + 1] = value >> 8
+
+
+class DotStar():
+    """ A simulated strip of APA102 pixels """
+
+    def __init__(self, clock, data, n, brightness=1.0, auto_write=True):
+        """
+        A simulated strip of APA102 pixels. Initialization sets the following properties:
+        - brightness
+        - auto_write
+        - frames, the number of times the pixels have been written to the strip
+        """
+        self.clock = clock
+        self.data = data
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self.frames = 0
+        self.on_show = None
+        self._pixels = [(0, 0, 0, 1.0)] * n
+
+    def __len__(self):
+        return len(self._pixels)
+
+    def __getitem__(self, index):
+        return self._pixels[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(value, int):
+            # A packed 0xRRGGBB value, shown at full brightness
+            value = (value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF, 1.0)
+        elif len(value) == 3:
+            value = (value[0], value[1], value[2], 1.0)
+        self._pixels[index] = tuple(value)
+        if self.auto_write:
+            self.show()
+
+    def fill(self, value):
+        """ Sets every pixel to the same value """
+        auto_write = self.auto_write
+        self.auto_write = False
+        for index in range(len(self._pixels)):
+            self[index] = value
+        self.auto_write = auto_write
+        if auto_write:
+            self.show()
+
+    def show(self):
+        """ Writes the pixels to the strip """
+        self.frames += 1
+        if self.on_show is not None:
+            self.on_show(self)
+
+    def frame(self):
+        """ Returns the colours as shown, a tuple of (red, green, blue) for each pixel scaled by its brightness """
+        return tuple(
+            (int(red * pixel_brightness), int(green * pixel_brightness), int(blue * pixel_brightness))
+            for red, green, blue, pixel_brightness in self._pixels
+        )
+
+
+class HIDDevice():
+    """ A simulated USB HID device, recording the reports sent to the computer """
+
+    def __init__(self, usage_page, usage):
+        """
+        A simulated USB HID device. Initialization sets the following properties:
+        - reports, the list of reports sent
+        """
+        self.usage_page = usage_page
+        self.usage = usage
+        self.reports = []
+        self.on_report = None
+
+    def send_report(self, report, report_id=None):
+        """ Records the report """
+        report = bytes(report)
+        self.reports.append(report)
+        if self.on_report is not None:
+            self.on_report(report)
+
+    def get_last_received_report(self, report_id=None):
+        """ The computer never sends reports to the simulated device """
+        return None
+
+
+class SerialPipe():
+    """ A simulated usb_cdc serial port, with a device end and a computer end """
+
+    def __init__(self):
+        """ A simulated usb_cdc serial port, with a device end and a computer end """
+        self.timeout = None
+        self.connected = True
+        self._to_device = bytearray()
+        self._to_host = bytearray()
+        self._condition = threading.Condition()
+
+    # Device end, as used by KeypadSerial
+
+    @property
+    def in_waiting(self):
+        """ The number of bytes waiting to be read by the device """
+        with self._condition:
+            return len(self._to_device)
+
+    def readinto(self, buffer):
+        """ Reads bytes waiting for the device into the buffer, returns the number of bytes read """
+        with self._condition:
+            count = min(len(buffer), len(self._to_device))
+            buffer[:count] = self._to_device[:count]
+            del self._to_device[:count]
+            return count
+
+    def write(self, data):
+        """ Sends bytes from the device to the computer """
+        with self._condition:
+            self._to_host += data
+            self._condition.notify_all()
+            return len(data)
+
+    # Computer end, as used by the companion daemon
+
+    def host_write(self, data):
+        """ Sends bytes from the computer to the device """
+        with self._condition:
+            self._to_device += data
+
+    def host_read(self, timeout=None):
+        """ Reads the bytes sent by the device, waiting up to the timeout for some to arrive """
+        with self._condition:
+            if not self._to_host:
+                self._condition.wait(timeout)
+            data = bytes(self._to_host)
+            self._to_host.clear()
+            return data
+
+
+keyboard_device = HIDDevice(0x01, 0x06)
+""" The simulated keyboard, found by adafruit_hid among usb_hid.devices """
+
+
+def install():
+    """ Registers the simulated modules, so importing pimoronikeypad uses them """
+    if 'board' in sys.modules and getattr(sys.modules['board'], 'simulated', False):
+        return
+
+    board = types.ModuleType('board')
+    board.simulated = True
+    for number in range(29):
+        setattr(board, 'GP' + str(number), Pin('GP' + str(number)))
+
+    busio = types.ModuleType('busio')
+    busio.I2C = I2C
+
+    digitalio = types.ModuleType('digitalio')
+    digitalio.DigitalInOut = DigitalInOut
+    digitalio.Direction = Direction
+
+    bus_device = types.ModuleType('adafruit_bus_device')
+    bus_device.__path__ = []
+    i2c_device = types.ModuleType('adafruit_bus_device.i2c_device')
+    i2c_device.I2CDevice = I2CDevice
+    bus_device.i2c_device = i2c_device
+
+    dotstar = types.ModuleType('adafruit_dotstar')
+    dotstar.DotStar = DotStar
+
+    usb_hid = types.ModuleType('usb_hid')
+    usb_hid.Device = HIDDevice
+    usb_hid.devices = [keyboard_device]
+
+    usb_cdc = types.ModuleType('usb_cdc')
+    usb_cdc.console = None
+    usb_cdc.data = None
+
+    # adafruit_hid waits a second for USB to be ready when supervisor is missing
+    supervisor = types.ModuleType('supervisor')
+    supervisor.runtime = types.SimpleNamespace(usb_connected=True)
+
+    sys.modules.update({
+        'board': board,
+        'busio': busio,
+        'digitalio': digitalio,
+        'adafruit_bus_device': bus_device,
+        'adafruit_bus_device.i2c_device': i2c_device,
+        'adafruit_dotstar': dotstar,
+        'supervisor': supervisor,
+        'usb_hid': usb_hid,
+        'usb_cdc': usb_cdc
+    })
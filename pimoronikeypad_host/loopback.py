@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+
+from . import hardware
+
+
+"""
+loopback
+================================================================================
+A stand-in for a real keypad, running the pimoronikeypad library against
+simulated hardware with the same config.json as the device. The companion
+daemon can talk to it in place of a serial port
+"""
+
+class LoopbackKeypad():
+    """ A simulated keypad, running the device code in a background thread """
+
+    def __init__(self, config_file='config.json', state_file=None, interval=0.001):
+        """
+        A simulated keypad, running the device code in a background thread. Initialization sets the following properties:
+        - keypad, the PimoroniKeypad running on simulated hardware
+        - serial, the KeypadSerial handling packets from the daemon
+        - pipe, the simulated serial port between the daemon and the keypad
+        - scheduler, the same scheduler code.py runs
+        - interval, the time in seconds between passes of the main loop
+
+        When state_file is None, state is persisted next to the configuration if enabled
+        """
+        hardware.install()
+        from pimoronikeypad import PimoroniKeypad, KeypadSerial, KeypadScheduler
+
+        config_file = os.path.abspath(config_file)
+        if state_file is None:
+            state_file = os.path.join(os.path.dirname(config_file), 'keypad_state.log')
+        keypad_class = type('LoopbackPimoroniKeypad', (PimoroniKeypad,), {
+            'config_file': config_file,
+            'state_file': state_file
+        })
+
+        self.keypad = keypad_class()
+        self.pipe = hardware.SerialPipe()
+        self.serial = KeypadSerial(self.keypad, self.pipe)
+        self.scheduler = KeypadScheduler.for_keypad(self.keypad, self.serial)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    @property
+    def i2c(self):
+        """ The simulated I2C bus the keys are read from """
+        return self.keypad._i2c
+
+    @property
+    def pixels(self):
+        """ The simulated pixels of the keypad """
+        self.keypad._load_pixels()
+        return self.keypad._pixels
+
+    @property
+    def reports(self):
+        """ The HID reports the keypad has sent to the computer """
+        return hardware.keyboard_device.reports
+
+    def press(self, x, y):
+        """ Presses down the key at the given coordinates """
+        self.i2c.press(self.keypad.coordinates_to_index(x, y))
+
+    def release(self, x, y):
+        """ Releases the key at the given coordinates """
+        self.i2c.release(self.keypad.coordinates_to_index(x, y))
+
+    def step(self):
+        """ Runs a single pass of the scheduler, as run by code.py """
+        with self._lock:
+            self.scheduler.run_once()
+
+    def start(self):
+        """ Starts running the main loop in a background thread """
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='LoopbackKeypad', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ Stops the background thread """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Runs the main loop until stopped """
+        while self._running:
+            self.step()
+            time.sleep(self.interval)
+
+    # Transport interface used by the companion daemon
+
+    def read(self, timeout=0.1):
+        """ Reads the bytes sent by the keypad, waiting up to the timeout """
+        return self.pipe.host_read(timeout)
+
+    def write(self, data):
+        """ Sends bytes to the keypad """
+        self.pipe.host_write(data)
+
+    def close(self):
+        """ Stops the keypad """
+        self.stop()
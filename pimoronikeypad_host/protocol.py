@@ -0,0 +1,124 @@
+"""
+protocol
+================================================================================
+The computer end of the binary serial protocol implemented on the keypad by
+pimoronikeypad.KeypadSerial, see its documentation for the packet format
+"""
+
+SYNC = 0xA5
+FRAME = 0x01
+RUN = 0x02
+LAYER = 0x03
+COUNTERS = 0x04
+PING = 0x05
+SUBSCRIBE = 0x06
+PROFILE = 0x07
+KEYS = 0x08
+KEY_EVENT = 0x40
+ERROR = 0x7F
+REPLY = 0x80
+
+VERSION = 3
+""" The version of the protocol spoken by the keypad """
+
+STATUSES = {
+    0x00: 'ok',
+    0x01: 'bad checksum',
+    0x02: 'unknown command',
+    0x03: 'bad payload',
+    0x04: 'key is not programmed'
+}
+""" The status bytes sent in replies, mapped to a description """
+
+FRAME_SIZE = 48
+""" The number of bytes in a frame, red, green and blue for each key """
+
+
+def encode(command, payload=b''):
+    """ Returns the packet for the given command and payload """
+    payload = bytes(payload)
+    if len(payload) > 255:
+        raise ValueError('payload must be 255 bytes or fewer')
+    checksum = command ^ len(payload)
+    for byte in payload:
+        checksum ^= byte
+    return bytes([SYNC, command, len(payload)]) + payload + bytes([checksum])
+
+
+def encode_frame(colours, brightness=None):
+    """ Returns a frame packet, from a list of (red, green, blue) for each key and an optional brightness between 0 and 1 """
+    if len(colours) != 16:
+        raise ValueError('colours must have a value for each of the 16 keys')
+    payload = bytearray()
+    for colour in colours:
+        payload.extend(clamp(value) for value in colour[:3])
+    if brightness is not None:
+        payload.append(clamp(round(brightness * 255)))
+    return encode(FRAME, payload)
+
+
+def encode_keys(colours, brightness=None):
+    """
+    Returns a packet showing a frame on some of the keys, from a list of (red, green, blue) for each key, or None for
+    the keys that keep their own colours, and an optional brightness between 0 and 1
+    """
+    if len(colours) != 16:
+        raise ValueError('colours must have a value for each of the 16 keys')
+    mask = 0
+    payload = bytearray(2)
+    for index, colour in enumerate(colours):
+        if colour is None:
+            payload.extend(b'\x00\x00\x00')
+        else:
+            mask |= 1 << index
+            payload.extend(clamp(value) for value in colour[:3])
+    payload[0] = mask >> 8
+    payload[1] = mask & 0xFF
+    if brightness is not None:
+        payload.append(clamp(round(brightness * 255)))
+    return encode(KEYS, payload)
+
+
+def clamp(value):
+    """ Limits a value to a single byte """
+    return max(0, min(255, int(value)))
+
+
+class Decoder():
+    """ Splits a stream of bytes from the keypad into (command, payload) packets """
+
+    def __init__(self):
+        """ Splits a stream of bytes from the keypad into (command, payload) packets """
+        self._buffer = bytearray()
+        self.dropped = 0
+
+    def feed(self, data):
+        """ Adds the data to the stream, and returns a list of the complete packets """
+        self._buffer += data
+        packets = []
+        buffer = self._buffer
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                self.dropped += len(buffer)
+                buffer.clear()
+                break
+            if start:
+                self.dropped += start
+                del buffer[:start]
+            if len(buffer) < 3 or len(buffer) < buffer[2] + 4:
+                break
+            command = buffer[1]
+            length = buffer[2]
+            payload = bytes(buffer[3:3 + length])
+            checksum = command ^ length
+            for byte in payload:
+                checksum ^= byte
+            if checksum != buffer[3 + length]:
+                # Not a real packet, resynchronise from the next byte
+                self.dropped += 1
+                del buffer[:1]
+                continue
+            del buffer[:length + 4]
+            packets.append((command, payload))
+        return packets
@@ -0,0 +1,434 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import importlib
+import argparse
+import tempfile
+
+from . import hardware
+
+
+"""
+replay
+================================================================================
+A harness that replays recorded or synthetic key traces through the keypad
+code, running the same scheduler as code.py on simulated hardware against a
+virtual clock. The clock is moved on inside the code as it runs, by a fixed
+cost for each read of the keys over I2C, each HID report, each frame written to
+the LEDs and each time the clock is read, so a replay gives the same result
+every time it is run. It checks the HID reports and LED frames produced against
+the expected output, and finds the highest rate of key presses the keypad keeps
+up with before presses are missed.
+
+A trace is a text file with a line per change of the keys, made up of the time
+in milliseconds and the keys held down from then on as a 16 bit hexadecimal
+mask (bit 0 is the top left key), for example:
+
+    # time_ms keys
+    0 0000
+    120.5 0001
+    180 0000
+"""
+
+class VirtualClock():
+    """ Stands in for the time module of the keypad code, only moving forward when told to, slept, or read """
+
+    def __init__(self, read_time=0.0):
+        """
+        Stands in for the time module of the keypad code, starting at 0 seconds. Initialization sets the following property:
+        - read_time, the time in seconds each read of the clock moves it on by
+        """
+        self.now = 0.0
+        self.read_time = read_time
+
+    def monotonic(self):
+        self.now += self.read_time
+        return self.now
+
+    def monotonic_ns(self):
+        self.now += self.read_time
+        return int(self.now * 1000000000)
+
+    def time(self):
+        self.now += self.read_time
+        return self.now
+
+    def sleep(self, seconds):
+        """ Moves the clock forward, rather than waiting """
+        self.now += seconds
+
+    def advance(self, seconds):
+        """ Moves the clock forward """
+        self.now += seconds
+
+
+class ReplayResult():
+    """ The outcome of replaying a trace """
+
+    def __init__(self, presses, missed, scans, reports, frames, duration, wall_time, passes=0):
+        """
+        The outcome of replaying a trace. Initialization sets the following properties:
+        - presses, the number of key presses in the trace
+        - missed, a list of the (key index, time pressed) of presses the keypad did not register
+        - scans, the number of times the keys were read
+        - reports, the list of HID reports sent, as (time, bytes)
+        - frames, the list of LED frames shown, as (time, tuple of (red, green, blue) per key)
+        - duration, the virtual time replayed in seconds
+        - wall_time, the real time taken to replay in seconds
+        - passes, the number of passes of the main loop
+        """
+        self.presses = presses
+        self.missed = missed
+        self.scans = scans
+        self.reports = reports
+        self.frames = frames
+        self.duration = duration
+        self.wall_time = wall_time
+        self.passes = passes
+        self.mismatches = []
+
+    @property
+    def transitions(self):
+        """ The number of key presses and releases in the trace """
+        return self.presses * 2
+
+    def expected_output(self):
+        """ Returns the HID reports and LED frames in the format read by check() """
+        return {
+            'reports': [report.hex() for moment, report in self.reports],
+            'frames': [[list(colour) for colour in frame] for moment, frame in self.frames]
+        }
+
+    def check(self, expected):
+        """ Compares the HID reports and LED frames with the expected output, returns a list of the differences """
+        actual = self.expected_output()
+        self.mismatches = []
+        for name in ('reports', 'frames'):
+            if name not in expected:
+                continue
+            for index, (wanted, produced) in enumerate(zip(expected[name], actual[name])):
+                if wanted != produced:
+                    self.mismatches.append('{} {}: expected {}, got {}'.format(name[:-1], index, wanted, produced))
+                    break
+            if len(expected[name]) != len(actual[name]):
+                self.mismatches.append('expected {} {}, got {}'.format(len(expected[name]), name, len(actual[name])))
+        return self.mismatches
+
+    def summary(self):
+        """ Returns a description of the result """
+        lines = [
+            'replayed {:.3f}s of key presses in {:.3f}s'.format(self.duration, self.wall_time),
+            'presses {}, missed {}, scans {} ({:.0f} per second)'.format(
+                self.presses, len(self.missed), self.scans, self.scans / self.duration if self.duration else 0),
+            'passes of the main loop {}, {:.3f}ms each on average on the keypad'.format(
+                self.passes, self.duration * 1000 / self.passes if self.passes else 0),
+            'HID reports {}, LED frames {}'.format(len(self.reports), len(self.frames)),
+            'replay throughput {:.0f} transitions per second'.format(self.transitions / self.wall_time if self.wall_time else 0)
+        ]
+        for index, moment in self.missed[:10]:
+            lines.append('  missed key {} pressed at {:.1f}ms'.format(index, moment * 1000))
+        if len(self.missed) > 10:
+            lines.append('  ... and {} more'.format(len(self.missed) - 10))
+        lines.extend('  ' + mismatch for mismatch in self.mismatches)
+        return '\n'.join(lines)
+
+
+class ReplayHarness():
+    """ Replays key traces through the keypad code on simulated hardware """
+
+    timed_modules = ('PimoroniKeypad', 'KeypadStore', 'KeypadProfiler', 'KeypadTicks')
+    """ The modules of the keypad code whose time module is replaced by the virtual clock """
+
+    def __init__(self, config_file='config.json', i2c_time=0.0005, report_time=0.001, show_time=0.002, read_time=0.0001, loop_time=0.0, slowdown=0.0):
+        """
+        Replays key traces through the keypad code on simulated hardware. Initialization sets the following properties,
+        the times are in seconds and estimate the cost of each on the keypad:
+        - config_file
+        - i2c_time, the time to read the keys from the IO expander over I2C
+        - report_time, the time to send a HID report, which waits for the computer to poll the keyboard
+        - show_time, the time to write a frame to the LEDs
+        - read_time, the time each read of the clock moves it on by, standing in for the code run between reads
+        - loop_time, a fixed time added to each pass of the main loop
+        - slowdown, when greater than 0, the processor time each pass takes here is also multiplied by it and added to
+          the clock, which no longer gives the same result every time
+        """
+        self.config_file = config_file
+        self.i2c_time = i2c_time
+        self.report_time = report_time
+        self.show_time = show_time
+        self.read_time = read_time
+        self.loop_time = loop_time
+        self.slowdown = slowdown
+
+    def replay(self, trace, tail=1.0):
+        """ Runs the main loop of code.py through the trace, and for tail seconds after it, returns a ReplayResult """
+        clock = VirtualClock(self.read_time)
+        modules = self._use_clock(clock)
+        try:
+            return self._replay(clock, trace, tail)
+        finally:
+            self._restore_time(modules)
+
+    def _replay(self, clock, trace, tail):
+        """ Replays the trace with the keypad code running against the clock """
+        keypad = self._start_keypad()
+
+        # Import and set up the keyboard and LEDs before the trace, rather than charging their first use to it
+        keypad.keypad.get_keycode_dictionary()
+        keypad.keypad._load_keyboard()
+        keypad.keypad._load_pixels()
+
+        # The trace starts once the keypad has finished loading
+        start = clock.now
+        trace = [(moment + start, mask) for moment, mask in trace]
+        times = [moment for moment, mask in trace]
+        end = (trace[-1][0] if trace else start) + tail
+        scans = []
+        reports = []
+        frames = []
+
+        def read(i2c):
+            # The keys are sampled part way through the transfer
+            clock.advance(self.i2c_time / 2)
+            position = bisect.bisect_right(times, clock.now) - 1
+            i2c.pressed = trace[position][1] if position >= 0 else 0
+            scans.append(clock.now)
+            clock.advance(self.i2c_time / 2)
+
+        def report(report):
+            clock.advance(self.report_time)
+            reports.append((clock.now, report))
+
+        def show(pixels):
+            clock.advance(self.show_time)
+            frames.append((clock.now, pixels.frame()))
+
+        keypad.i2c.on_read = read
+        hardware.keyboard_device.on_report = report
+        keypad.pixels.on_show = show
+
+        wall_start = time.perf_counter()
+        passes = 0
+        # When measuring the code here, the computer's own garbage collection would be scaled up along with it, so
+        # collection is paused and only the processor time of this thread is measured
+        if self.slowdown:
+            gc.disable()
+        try:
+            while clock.now <= end:
+                pass_start = time.thread_time()
+                keypad.step()
+                if self.slowdown:
+                    clock.advance((time.thread_time() - pass_start) * self.slowdown)
+                clock.advance(self.loop_time)
+                passes += 1
+        finally:
+            gc.enable()
+            hardware.keyboard_device.on_report = None
+        wall_time = time.perf_counter() - wall_start
+
+        presses = _presses(trace)
+        missed = [(index, pressed - start) for index, pressed in _missed(presses, scans)]
+        return ReplayResult(len(presses), missed, len(scans), reports, frames, end - start, wall_time, passes)
+
+    def max_sustained_rate(self, low=10, high=20000, duration=2.0, keys=None, seed=0, tolerance=0.02):
+        """ Searches for the highest rate of transitions per second, as synthetic traces, the keypad registers every press of """
+        if self.replay(synthetic_trace(low, duration, keys=keys, seed=seed)).missed:
+            return 0
+        while (high - low) / high > tolerance:
+            rate = (low + high) / 2
+            if self.replay(synthetic_trace(rate, duration, keys=keys, seed=seed)).missed:
+                high = rate
+            else:
+                low = rate
+        return low
+
+    def unprogrammed_keys(self):
+        """ Returns the indexes of the keys without commands, pressing these never toggles the keypad or runs a command """
+        with open(self.config_file) as file:
+            config = json.load(file)
+        programmed = set(key['x'] * 4 + key['y'] for key in config['config'])
+        return [index for index in range(16) if index not in programmed]
+
+    def _use_clock(self, clock):
+        """ Runs the keypad code against the clock, returning the time modules it replaced for _restore_time() """
+        hardware.install()
+        replaced = {}
+        for name in self.timed_modules:
+            module = importlib.import_module('pimoronikeypad.' + name)
+            replaced[name] = module.time
+            module.time = clock
+        return replaced
+
+    def _restore_time(self, replaced):
+        """ Puts back the time modules replaced by _use_clock() """
+        for name, module in replaced.items():
+            sys.modules['pimoronikeypad.' + name].time = module
+
+    def _start_keypad(self):
+        """ Creates a loopback keypad, run against the virtual clock set by _use_clock() """
+        from .loopback import LoopbackKeypad
+        hardware.keyboard_device.reports.clear()
+        state_file = os.path.join(tempfile.mkdtemp(prefix='pimoronikeypad-replay-'), 'keypad_state.log')
+        return LoopbackKeypad(self.config_file, state_file=state_file)
+
+
+def load_trace(path):
+    """ Reads a trace file, returning a list of (time in seconds, mask of keys held) """
+    trace = []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                moment, mask = line.split()
+                trace.append((float(moment) / 1000, int(mask, 16) & 0xFFFF))
+            except ValueError:
+                raise ValueError('{} line {}: expected a time in milliseconds and a hexadecimal key mask'.format(path, number))
+    trace.sort(key=lambda change: change[0])
+    return trace
+
+
+def save_trace(trace, path):
+    """ Writes a trace to a file """
+    with open(path, 'w') as file:
+        file.write('# time_ms keys\n')
+        for moment, mask in trace:
+            file.write('{:g} {:04x}\n'.format(round(moment * 1000, 3), mask))
+
+
+def synthetic_trace(rate, duration, keys=None, seed=0, burst=20):
+    """
+    Generates a trace of bursty typing, at the given rate of transitions (presses and releases) per second during a
+    burst, with bursts of around burst presses separated by pauses as long as the bursts. Keys are held for half the
+    time until the next press, and chosen at random from keys (all 16 by default)
+    """
+    generator = random.Random(seed)
+    keys = list(range(16)) if keys is None else list(keys)
+    interval = 2 / rate
+    events = []
+    moment = 0.0
+    released_at = {}
+    while moment < duration:
+        for press in range(max(1, int(generator.expovariate(1 / burst)))):
+            available = [key for key in keys if released_at.get(key, -1) < moment]
+            if available:
+                key = generator.choice(available)
+                hold = interval / 2
+                events.append((moment, key, True))
+                events.append((moment + hold, key, False))
+                released_at[key] = moment + hold + interval / 2
+            moment += interval * generator.uniform(0.9, 1.1)
+            if moment >= duration:
+                break
+        moment += interval * burst
+    events.sort(key=lambda event: (event[0], event[2]))
+
+    trace = [(0.0, 0)]
+    mask = 0
+    for moment, key, pressed in events:
+        mask = mask | (1 << key) if pressed else mask & ~(1 << key)
+        if trace[-1][0] == moment:
+            trace[-1] = (moment, mask)
+        else:
+            trace.append((moment, mask))
+    return trace
+
+
+def _presses(trace):
+    """ Returns a list of the (key index, time pressed, time released) of each press in a trace """
+    presses = []
+    held = {}
+    previous = 0
+    for moment, mask in trace:
+        changed = previous ^ mask
+        for index in range(16):
+            if changed & (1 << index):
+                if mask & (1 << index):
+                    held[index] = moment
+                else:
+                    presses.append((index, held.pop(index), moment))
+        previous = mask
+    for index, pressed in held.items():
+        presses.append((index, pressed, float('inf')))
+    presses.sort(key=lambda press: press[1])
+    return presses
+
+
+def _missed(presses, scans):
+    """ Returns the presses not registered, those without a scan while held, or without a scan since the last release of the key """
+    missed = []
+    last_release = {}
+    for index, pressed, released in presses:
+        seen = bisect.bisect_left(scans, pressed) < bisect.bisect_left(scans, released)
+        if index in last_release:
+            seen = seen and bisect.bisect_left(scans, last_release[index]) < bisect.bisect_left(scans, pressed)
+        if not seen:
+            missed.append((index, pressed))
+        last_release[index] = released
+    return missed
+
+
+def main():
+    """ Parses the command line and replays a trace, or searches for the highest sustained rate """
+    parser = argparse.ArgumentParser(prog='python -m pimoronikeypad_host.replay', description='Replay key traces through the keypad code on simulated hardware')
+    parser.add_argument('trace', nargs='?', help='a trace file to replay')
+    parser.add_argument('--config', default='config.json', help='the configuration of the keypad (default: %(default)s)')
+    parser.add_argument('--i2c-time', type=float, default=0.5, help='the time to read the keys over I2C, in milliseconds (default: %(default)s)')
+    parser.add_argument('--report-time', type=float, default=1.0, help='the time to send a HID report, in milliseconds (default: %(default)s)')
+    parser.add_argument('--show-time', type=float, default=2.0, help='the time to write a frame to the LEDs, in milliseconds (default: %(default)s)')
+    parser.add_argument('--read-time', type=float, default=0.1, help='the time each read of the clock takes, standing in for the code run between reads, in milliseconds (default: %(default)s)')
+    parser.add_argument('--loop-time', type=float, default=0.0, help='a fixed time added to each pass of the main loop, in milliseconds (default: %(default)s)')
+    parser.add_argument('--slowdown', type=float, default=0.0, help='also add the processor time of each pass here, multiplied by SLOWDOWN, results then vary between runs (default: off)')
+    parser.add_argument('--synthetic', type=float, metavar='RATE', help='replay a synthetic trace of RATE transitions per second')
+    parser.add_argument('--duration', type=float, default=2.0, help='the length of synthetic traces, in seconds (default: %(default)s)')
+    parser.add_argument('--unprogrammed', action='store_true', help='only press keys without commands in synthetic traces, so the keypad is never toggled and runs no commands')
+    parser.add_argument('--seed', type=int, default=0, help='the seed used to generate synthetic traces (default: %(default)s)')
+    parser.add_argument('--save-trace', metavar='FILE', help='write the synthetic trace to FILE')
+    parser.add_argument('--expect', metavar='FILE', help='check the HID reports and LED frames against FILE')
+    parser.add_argument('--record', metavar='FILE', help='write the HID reports and LED frames to FILE, for use with --expect')
+    parser.add_argument('--sweep', action='store_true', help='search for the highest rate the keypad registers every press of')
+    arguments = parser.parse_args()
+
+    harness = ReplayHarness(
+        arguments.config,
+        i2c_time=arguments.i2c_time / 1000,
+        report_time=arguments.report_time / 1000,
+        show_time=arguments.show_time / 1000,
+        read_time=arguments.read_time / 1000,
+        loop_time=arguments.loop_time / 1000,
+        slowdown=arguments.slowdown
+    )
+    keys = harness.unprogrammed_keys() if arguments.unprogrammed else None
+
+    if arguments.sweep:
+        rate = harness.max_sustained_rate(duration=arguments.duration, keys=keys, seed=arguments.seed)
+        print('maximum sustained rate {:.0f} transitions per second'.format(rate))
+        return 0
+
+    if arguments.trace:
+        trace = load_trace(arguments.trace)
+    elif arguments.synthetic:
+        trace = synthetic_trace(arguments.synthetic, arguments.duration, keys=keys, seed=arguments.seed)
+        if arguments.save_trace:
+            save_trace(trace, arguments.save_trace)
+    else:
+        parser.error('give a trace file, --synthetic RATE, or --sweep')
+
+    result = harness.replay(trace)
+    if arguments.record:
+        with open(arguments.record, 'w') as file:
+            json.dump(result.expected_output(), file)
+    if arguments.expect:
+        with open(arguments.expect) as file:
+            result.check(json.load(file))
+    print(result.summary())
+    return 1 if result.missed or result.mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
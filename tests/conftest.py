@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The packages are run from the root of the repository rather than installed. The root is added after the standard
+# library, as the code.py run by CircuitPython would otherwise hide the standard library's code module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
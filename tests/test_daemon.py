@@ -0,0 +1,155 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from pimoronikeypad_host import hardware, protocol
+from pimoronikeypad_host.client import KeypadClient
+from pimoronikeypad_host.daemon import KeypadDaemon, KeypadError
+
+
+CONFIG = {
+    'brightness': 0.5,
+    'colour': {'red': 0, 'green': 0, 'blue': 255},
+    'loadPattern': 'simple',
+    'loadPatternDelay': 0,
+    'config': [
+        {
+            'x': 0,
+            'y': 0,
+            'colour': {'red': 255, 'green': 0, 'blue': 0},
+            'commands': [
+                [{'actionType': 'keyboardShortcut', 'action': ['control', 'c']}],
+                [{'actionType': 'enterText', 'action': 'hi'}]
+            ]
+        }
+    ]
+}
+
+
+def serve(tmp_path, body):
+    """ Runs body(keypad, daemon, client) against a daemon connected to a loopback keypad """
+    hardware.install()
+    pytest.importorskip('adafruit_hid')
+    from pimoronikeypad_host.loopback import LoopbackKeypad
+
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(CONFIG))
+    hardware.keyboard_device.reports.clear()
+    keypad = LoopbackKeypad(str(config_file), state_file=str(tmp_path / 'keypad_state.log'))
+    keypad.start()
+
+    async def main():
+        daemon = KeypadDaemon(keypad, str(tmp_path / 'keypad.sock'))
+        await daemon.start()
+        try:
+            async with KeypadClient(daemon.socket_path) as client:
+                return await body(keypad, daemon, client)
+        finally:
+            await daemon.stop()
+
+    return asyncio.run(main())
+
+
+async def wait_for(condition, timeout=2.0):
+    """ Waits until condition() is true """
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+def test_ping(tmp_path):
+    async def body(keypad, daemon, client):
+        assert await client.ping() == protocol.VERSION
+
+    serve(tmp_path, body)
+
+
+def test_run_counts_and_sends_reports(tmp_path):
+    async def body(keypad, daemon, client):
+        await client.run(0, 0, 0)
+        await wait_for(lambda: len(keypad.reports) > 0)
+        assert await client.counters(0, 0) == [1, 0]
+        with pytest.raises(KeypadError, match='key is not programmed'):
+            await client.run(1, 1, 0)
+
+    serve(tmp_path, body)
+
+
+def test_layer(tmp_path):
+    async def body(keypad, daemon, client):
+        await client.layer(0, 0, brightness=1.0)
+        assert keypad.keypad.toggled_key == (0, 0)
+        await client.reset()
+        assert keypad.keypad.toggled_key is None
+
+    serve(tmp_path, body)
+
+
+def test_batch(tmp_path):
+    async def body(keypad, daemon, client):
+        responses = await client.batch([
+            ('ping', {}),
+            ('set_colour', {'x': 3, 'y': 3, 'colour': [0, 255, 0]}),
+            ('counters', {'x': 0, 'y': 0})
+        ])
+        assert responses[0]['version'] == protocol.VERSION
+        assert responses[2]['counts'] == [0, 0]
+
+        # Only the key set changes, the others keep their own colours
+        await wait_for(lambda: keypad.pixels.frame()[15] == (0, 127, 0))
+        assert keypad.pixels.frame()[0] == (127, 0, 0)
+
+    serve(tmp_path, body)
+
+
+def test_key_events_delivered_to_subscriber(tmp_path):
+    async def body(keypad, daemon, client):
+        events = client.events()
+        event = asyncio.ensure_future(events.__anext__())
+        await wait_for(lambda: daemon._subscribers)
+        keypad.press(1, 2)
+        assert await asyncio.wait_for(event, 2) == {'event': 'key', 'index': 6, 'x': 1, 'y': 2, 'pressed': True}
+        keypad.release(1, 2)
+        assert (await asyncio.wait_for(events.__anext__(), 2))['pressed'] is False
+
+    serve(tmp_path, body)
+
+
+class SilentTransport():
+    """ A keypad that never replies, replies are handed to the daemon by the test """
+
+    def __init__(self):
+        self.written = []
+
+    def read(self, timeout=0.1):
+        time.sleep(timeout)
+        return b''
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        pass
+
+
+def test_late_reply_dropped_after_timeout(tmp_path):
+    transport = SilentTransport()
+
+    async def main():
+        daemon = KeypadDaemon(transport, str(tmp_path / 'keypad.sock'), reply_timeout=0.05)
+        daemon._loop = asyncio.get_running_loop()
+        with pytest.raises(KeypadError):
+            await daemon._request(protocol.PING)
+        second = asyncio.ensure_future(daemon._request(protocol.PING))
+        await asyncio.sleep(0)
+
+        # The reply to the timed out ping arrives late, then the replies to the resync ping and the second request
+        for version in (1, 2, 3):
+            daemon._on_data(protocol.encode(protocol.PING | protocol.REPLY, [version]))
+        assert await second == bytes([3])
+        assert len(transport.written) == 3
+
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+from pimoronikeypad_host import protocol
+
+
+def test_encode_decode_round_trip():
+    decoder = protocol.Decoder()
+    packets = decoder.feed(protocol.encode(protocol.RUN, [1, 2, 3]) + protocol.encode(protocol.PING))
+    assert packets == [(protocol.RUN, bytes([1, 2, 3])), (protocol.PING, b'')]
+    assert decoder.dropped == 0
+
+
+def test_decode_split_packet():
+    decoder = protocol.Decoder()
+    packet = protocol.encode(protocol.COUNTERS, [0, 1])
+    assert decoder.feed(packet[:3]) == []
+    assert decoder.feed(packet[3:]) == [(protocol.COUNTERS, bytes([0, 1]))]
+
+
+def test_decode_resyncs_after_bad_checksum():
+    decoder = protocol.Decoder()
+    bad = bytearray(protocol.encode(protocol.RUN, [1, 2, 3]))
+    bad[-1] ^= 0xFF
+    packets = decoder.feed(b'\x00\x01' + bytes(bad) + protocol.encode(protocol.PING, [7]))
+    assert packets == [(protocol.PING, bytes([7]))]
+    assert decoder.dropped > 0
+
+
+def test_encode_keys_masks_unset_keys():
+    colours = [None] * 16
+    colours[0] = (255, 0, 0)
+    colours[15] = (0, 0, 300)
+    command, payload = protocol.Decoder().feed(protocol.encode_keys(colours, 0.5))[0]
+    assert command == protocol.KEYS
+    assert payload[0] << 8 | payload[1] == 0x8001
+    assert list(payload[2:5]) == [255, 0, 0]
+    assert list(payload[47:50]) == [0, 0, 255]
+    assert payload[50] == 128
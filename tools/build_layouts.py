@@ -0,0 +1,192 @@
+"""
+build_layouts
+================================================================================
+Host side tool that precomputes the keyboard layout tables used by the keypad.
+
+Each layout is described below as the characters produced by each physical key,
+plain, with shift held, and with AltGr held. The tool flattens these into the
+lookup tables found in pimoronikeypad/layouts, so the device can turn any
+character into a HID keycode with a single index, rather than searching at
+runtime.
+
+Run from the root of the repository:
+
+    python tools/build_layouts.py
+"""
+
+import os
+
+SHIFT = 0xE1
+""" Keycode of the left shift modifier """
+
+ALTGR = 0xE6
+""" Keycode of the right alt (AltGr) modifier """
+
+CONTROL_KEYS = [
+    (0x28, '\n'),
+    (0x29, '\x1b'),
+    (0x2A, '\b'),
+    (0x2B, '\t'),
+    (0x2C, ' '),
+    (0x4C, '\x7f')
+]
+""" Keys that produce the same control character regardless of layout """
+
+LETTERS = [(0x04 + offset, letter, letter.upper(), None) for offset, letter in enumerate('abcdefghijklmnopqrstuvwxyz')]
+""" The letter keys of a QWERTY keyboard, as (keycode, plain, shift, altgr) """
+
+US = LETTERS + [
+    (0x1E, '1', '!', None),
+    (0x1F, '2', '@', None),
+    (0x20, '3', '#', None),
+    (0x21, '4', '$', None),
+    (0x22, '5', '%', None),
+    (0x23, '6', '^', None),
+    (0x24, '7', '&', None),
+    (0x25, '8', '*', None),
+    (0x26, '9', '(', None),
+    (0x27, '0', ')', None),
+    (0x2D, '-', '_', None),
+    (0x2E, '=', '+', None),
+    (0x2F, '[', '{', None),
+    (0x30, ']', '}', None),
+    (0x31, '\\', '|', None),
+    (0x33, ';', ':', None),
+    (0x34, "'", '"', None),
+    (0x35, '`', '~', None),
+    (0x36, ',', '<', None),
+    (0x37, '.', '>', None),
+    (0x38, '/', '?', None)
+]
+""" United States layout """
+
+UK = LETTERS + [
+    (0x1E, '1', '!', None),
+    (0x1F, '2', '"', None),
+    (0x20, '3', '£', None),
+    (0x21, '4', '$', '€'),
+    (0x22, '5', '%', None),
+    (0x23, '6', '^', None),
+    (0x24, '7', '&', None),
+    (0x25, '8', '*', None),
+    (0x26, '9', '(', None),
+    (0x27, '0', ')', None),
+    (0x2D, '-', '_', None),
+    (0x2E, '=', '+', None),
+    (0x2F, '[', '{', None),
+    (0x30, ']', '}', None),
+    (0x32, '#', '~', None),
+    (0x33, ';', ':', None),
+    (0x34, "'", '@', None),
+    (0x35, '`', '¬', '¦'),
+    (0x36, ',', '<', None),
+    (0x37, '.', '>', None),
+    (0x38, '/', '?', None),
+    (0x64, '\\', '|', None)
+]
+""" United Kingdom layout """
+
+DE = [key for key in LETTERS if key[1] not in 'eqmyz'] + [
+    (0x08, 'e', 'E', '€'),
+    (0x14, 'q', 'Q', '@'),
+    (0x10, 'm', 'M', 'µ'),
+    (0x1C, 'z', 'Z', None),
+    (0x1D, 'y', 'Y', None),
+    (0x1E, '1', '!', None),
+    (0x1F, '2', '"', '²'),
+    (0x20, '3', '§', '³'),
+    (0x21, '4', '$', None),
+    (0x22, '5', '%', None),
+    (0x23, '6', '&', None),
+    (0x24, '7', '/', '{'),
+    (0x25, '8', '(', '['),
+    (0x26, '9', ')', ']'),
+    (0x27, '0', '=', '}'),
+    (0x2D, 'ß', '?', '\\'),
+    (0x2F, 'ü', 'Ü', None),
+    (0x30, '+', '*', '~'),
+    (0x32, '#', "'", None),
+    (0x33, 'ö', 'Ö', None),
+    (0x34, 'ä', 'Ä', None),
+    (0x35, None, '°', None),
+    (0x36, ',', ';', None),
+    (0x37, '.', ':', None),
+    (0x38, '-', '_', None),
+    (0x64, '<', '>', '|')
+]
+""" German layout, the dead keys (^, ` and the acute accent) are not included """
+
+LAYOUTS = {
+    'us': US,
+    'uk': UK,
+    'de': DE
+}
+""" The layouts to generate, mapped to the value used in the configuration """
+
+
+def build_table(keys):
+    """ Flattens a layout description into an ASCII table and a dictionary of higher characters """
+    ascii_table = bytearray(256)
+    higher = {}
+    entries = [(keycode, character, 0) for keycode, character in CONTROL_KEYS]
+    for keycode, plain, shift, altgr in keys:
+        entries.append((keycode, plain, 0))
+        entries.append((keycode, shift, SHIFT))
+        entries.append((keycode, altgr, ALTGR))
+
+    for keycode, character, modifier in entries:
+        if character is None:
+            continue
+        code_point = ord(character)
+        if code_point < 128:
+            if ascii_table[code_point * 2 + 1]:
+                raise ValueError('Character {!r} is mapped more than once'.format(character))
+            ascii_table[code_point * 2] = modifier
+            ascii_table[code_point * 2 + 1] = keycode
+        else:
+            if code_point in higher:
+                raise ValueError('Character {!r} is mapped more than once'.format(character))
+            higher[code_point] = modifier << 8 | keycode
+    return bytes(ascii_table), higher
+
+
+def render_module(name, ascii_table, higher):
+    """ Renders the tables as the source of a python module """
+    lines = [
+        '"""',
+        name,
+        '=' * 80,
+        'Keyboard layout tables generated by tools/build_layouts.py, do not edit',
+        '',
+        'ASCII holds a (modifier, keycode) pair of bytes for each character below 128,',
+        'HIGHER maps any other supported character to modifier << 8 | keycode',
+        '"""',
+        '',
+        'ASCII = ('
+    ]
+    for offset in range(0, len(ascii_table), 16):
+        row = ''.join('\\x{:02x}'.format(value) for value in ascii_table[offset:offset + 16])
+        lines.append("    b'{}'".format(row))
+    lines.append(')')
+    lines.append('')
+    lines.append('HIGHER = {')
+    for code_point in sorted(higher):
+        lines.append('    0x{:04x}: 0x{:04x},'.format(code_point, higher[code_point]))
+    lines.append('}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def main():
+    """ Writes a module for each layout into the pimoronikeypad/layouts folder """
+    output_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pimoronikeypad', 'layouts')
+    for name, keys in LAYOUTS.items():
+        ascii_table, higher = build_table(keys)
+        path = os.path.join(output_folder, name + '.py')
+        with open(path, 'w') as file:
+            file.write(render_module(name, ascii_table, higher))
+        print('Wrote', os.path.normpath(path))
+
+
+if __name__ == '__main__':
+    main()